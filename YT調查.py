@@ -1,18 +1,27 @@
-import streamlit as st
-from youtube_transcript_api import YouTubeTranscriptApi
-import google.generativeai as genai
-import yt_dlp
-import os
-import re
 import time
-import requests
-from PIL import Image
+_script_start = time.perf_counter()
+import json
+from datetime import datetime
+import streamlit as st
 import nest_asyncio
-import gc
-from io import BytesIO
-from datetime import datetime, timedelta
-from docx import Document
-from docx.enum.text import WD_ALIGN_PARAGRAPH 
+# 核心模組不在載入時 import genai / yt_dlp / docx / PIL，第一次用到才載入 (見 trendscope_lazy)
+from trendscope_core import (
+    DEFAULT_MODEL, sort_models_by_version, create_word_docx, get_disk_cache, registry_namespace,
+    configure_client, get_model_with_fallback, run_inputs, report_contents,
+    generate_text, run_youtube_pipeline, run_tiktok_pipeline, run_social_pipeline, generate_report,
+    SEARCH_INSTRUCTION, build_followup_contents, create_context_cache, drop_context_cache, context_cache_gone, get_cached_model,
+    get_model_catalogue, resolve_models, generate_routed, COMMENT_FETCH_LIMIT, COMMENT_FETCH_MAX,
+)
+from trendscope_quota import scheduler
+from trendscope_budget import default_budget, count_tokens_or_estimate
+from trendscope_media import AUDIO_PROFILES, VIDEO_PROFILES, PROFILE_LABELS, ffmpeg_available
+from trendscope_workspace import sweep_orphans
+from trendscope_images import IMAGE_FORMATS, DEFAULT_QUALITY, max_edge_for_model
+from trendscope_models import AUTO_MODEL, model_stats
+from trendscope_trace import start_trace, timeline, to_otlp
+from trendscope_reports import get_report_store
+from trendscope_discovery import DEFAULT_TOP_K, MAX_TOP_K, DEFAULT_SCAN_LIMIT, MAX_SCAN_LIMIT, RANK_MODES, discover_videos
+_import_s = time.perf_counter() - _script_start
 
 nest_asyncio.apply()
 
@@ -46,176 +55,158 @@ st.markdown("""
 if "analysis_report" not in st.session_state: st.session_state.analysis_report = ""
 if "raw_context" not in st.session_state: st.session_state.raw_context = ""
 if "sorted_models" not in st.session_state: st.session_state.sorted_models = []
+if "model_catalogue" not in st.session_state: st.session_state.model_catalogue = []
 if "gemini_files_list" not in st.session_state: st.session_state.gemini_files_list = [] 
 if "social_images_list" not in st.session_state: st.session_state.social_images_list = [] 
 if "generated_script" not in st.session_state: st.session_state.generated_script = ""
-
-# --- 4. 智慧 API 呼叫 ---
-def smart_api_call(func, *args, **kwargs):
-    max_retries = 3
-    base_wait = 5
-    for attempt in range(max_retries):
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            if "429" in str(e) or "503" in str(e):
-                wait_time = base_wait * (2 ** attempt)
-                st.toast(f"API 冷卻中... {wait_time}秒", icon="⏳")
-                time.sleep(wait_time)
-            else:
-                raise e
-    raise Exception("API 重試失敗")
-
-# --- 核心：模型排序 ---
-def sort_models_by_version(models):
-    def score_model(name):
-        score = 0
-        if "gemini-1.5-flash" in name: score += 10000 
-        elif "gemini-2.0" in name: score += 5000 
-        elif "gemini-1.5-pro" in name: score += 1000
-        return score
-    valid_models = [m for m in models if "gemini" in m]
-    return sorted(valid_models, key=score_model, reverse=True)
-
-# --- Word 導出 ---
-def create_word_docx(text, title="分析報告"):
-    doc = Document()
-    doc.add_heading(f'TrendScope {title}', 0).alignment = WD_ALIGN_PARAGRAPH.CENTER
-    doc.add_paragraph(f"生成時間: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    for line in text.split('\n'):
-        line = line.strip()
-        if not line: continue
-        if line.startswith('# '): doc.add_heading(line.replace('# ', ''), 1)
-        elif line.startswith('## '): doc.add_heading(line.replace('## ', ''), 2)
-        elif line.startswith('### '): doc.add_heading(line.replace('### ', ''), 3)
-        elif line.startswith('- '): doc.add_paragraph(line.replace('- ', ''), style='List Bullet')
-        else: doc.add_paragraph(line)
-    buffer = BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
-
-def safe_remove(filepath):
-    try:
-        if os.path.exists(filepath):
-            gc.collect()
-            time.sleep(0.5)
-            os.remove(filepath)
-    except: pass
+if "latency_log" not in st.session_state: st.session_state.latency_log = []
+if "context_cache" not in st.session_state: st.session_state.context_cache = None
+if "run_trace" not in st.session_state: st.session_state.run_trace = []
+if "perf_log" not in st.session_state: st.session_state.perf_log = []
+if "run_id" not in st.session_state: st.session_state.run_id = None
+
+# --- UI 輔助 ---
+def toast_api_wait(wait_time):
+    st.toast(f"API 冷卻中... {wait_time}秒", icon="⏳")
+
+def toast_search_fallback():
+    st.toast("⚠️ Search Tool 初始化失敗，已切換為標準模式。", icon="🔧")
+
+def log_latency(record):
+    st.session_state.latency_log = (st.session_state.latency_log + [record])[-20:]
+
+def release_context_cache(e):
+    """追問快取過期 / 被刪除 / 無權限時釋放遠端快取並改走一般模式；其他錯誤 (含限流重試失敗) 照常拋出，不重送整包素材"""
+    if not context_cache_gone(e): raise e
+    drop_context_cache(st.session_state.context_cache)
+    st.session_state.context_cache = None
+
+def followup_from_cache(api_key, contents, task, stream, on_chunk):
+    """有追問快取時直接對快取提問 (不重送素材)；沒有快取或快取已失效時回傳 (None, None)，由呼叫端改走一般模式"""
+    if not st.session_state.context_cache: return None, None
+    configure_client(api_key)  # 快取模型每次重建，同樣要先確認是這個 session 的 Key
+    try: return generate_text(get_cached_model(st.session_state.context_cache), contents, task=task, stream=stream, on_chunk=on_chunk, on_wait=toast_api_wait)
+    except Exception as e:
+        release_context_cache(e)
+        return None, None
+
+def show_messages(messages):
+    for level, text in messages:
+        {"error": st.error, "info": st.info}.get(level, st.warning)(text)
+
+@st.cache_resource
+def startup_sweep():
+    # 每個行程只做一次：清掉上次崩潰留下的暫存目錄
+    return sweep_orphans()
+
+@st.cache_resource
+def cold_start():
+    # 行程第一次執行腳本時的 import 耗時；之後的重跑模組已在 sys.modules，import 幾乎為 0
+    return {"import_s": _import_s}
+
+@st.cache_resource(show_spinner=False)
+def cached_model(api_key, model_name, use_search=False, _on_fallback=None):
+    # 保留模型物件，重跑 / 追問不必重建；api_key 只是避免不同 Key 共用同一個物件，並不隔離憑證 (見 configure_client)
+    return get_model_with_fallback(model_name, use_search=use_search, on_fallback=_on_fallback)
+
+def use_model(api_key, model_name, use_search=False, on_fallback=None):
+    # genai.configure 是全行程共用：每次取用都重新確認目前 session 的 Key，不只在快取未命中時
+    configure_client(api_key)
+    return cached_model(api_key, model_name, use_search, on_fallback)
+
+def record_perf(paint_s):
+    st.session_state.perf_log = (st.session_state.perf_log + [{"import_s": _import_s, "paint_s": paint_s, "script_s": time.perf_counter() - _script_start}])[-50:]
+
+disk_cache = get_disk_cache()
+report_store = get_report_store()
+startup_sweep()
+cold_start()
 
 # --- 側邊欄 ---
 with st.sidebar:
     st.title("🧠 深度控制中心")
     api_key = st.text_input("Google API Key", type="password", value=st.session_state.get("api_key", ""))
+    model_factory = lambda name, use_search=False, on_fallback=None: use_model(api_key, name, use_search, on_fallback)
     
     if st.button("🔄 連結 Google Brain"):
         if api_key:
             try:
-                genai.configure(api_key=api_key)
-                all_models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-                st.session_state.sorted_models = sort_models_by_version(all_models)
+                configure_client(api_key)
+                st.session_state.model_catalogue = get_model_catalogue(registry_namespace(api_key))
+                st.session_state.sorted_models = sort_models_by_version([m["name"] for m in st.session_state.model_catalogue])
+                for m in st.session_state.sorted_models: scheduler.configure(m)
                 st.session_state.api_key = api_key
                 st.success(f"已連接：{st.session_state.sorted_models[0]}")
             except Exception as e: st.error(f"錯誤: {e}")
 
-    options = st.session_state.sorted_models if st.session_state.sorted_models else ["models/gemini-1.5-flash"]
-    selected_model = st.selectbox("核心引擎", options)
+    options = [AUTO_MODEL] + st.session_state.sorted_models if st.session_state.sorted_models else [DEFAULT_MODEL]
+    selected_model = st.selectbox("核心引擎", options, format_func=lambda m: "🤖 自動 (依任務挑最快模型)" if m == AUTO_MODEL else m)
+    catalogue = st.session_state.model_catalogue
+    # auto 時，預算 / 額度 / 圖片尺寸等預設值以目前排第一的分析模型為準
+    base_model = resolve_models(selected_model, "analysis", catalogue)[0]
+    with st.expander("🚦 配額 / 限流"):
+        if selected_model == AUTO_MODEL: st.caption(f"目前設定：{base_model}")
+        cur_rpm, cur_tpm = scheduler.limits(base_model)
+        q_rpm = st.number_input("每分鐘請求數 (RPM)", 1, 10000, cur_rpm)
+        q_tpm = st.number_input("每分鐘 Token (TPM)", 1000, 100_000_000, cur_tpm, step=1000)
+        scheduler.configure(base_model, q_rpm, q_tpm)
+        for m, stat in scheduler.stats().items():
+            st.caption(f"{m.replace('models/', '')}：{stat['requests']} 次 · 排隊 {stat['queued_s']:.1f}s · 限流 {stat['throttled']} 次 / 退避 {stat['backoff_s']:.0f}s")
+        for m, stat in model_stats.snapshot().items():
+            speed = f" · {stat['chars_per_s']:.0f} 字/秒" if stat["chars_per_s"] else ""
+            latency = f"{stat['latency']:.1f}s" if stat["latency"] is not None else "—"
+            st.caption(f"📈 {m.replace('models/', '')}：平均 {latency}{speed} · 錯誤率 {stat['error_rate']:.0%}")
     
     token_saver_mode = st.toggle("🍃 Token 節約模式 (YT)", value=True)
+    token_budget = st.slider("🎯 單次分析 Token 預算 (千)", 10, 1000, default_budget(base_model) // 1000, step=10, help="YT 字幕 / 留言會依此預算平均分配並裁切") * 1000
+    use_cache = not st.toggle("🚫 略過本機快取", value=False, help="勾選後一律重新抓取 Metadata / 留言 / 字幕")
+    if st.button("🧹 清除快取"):
+        disk_cache.clear()
+        st.success("快取已清除")
+    cache_stats = disk_cache.stats()
+    if cache_stats: st.caption("📦 快取: " + " / ".join(f"{k} {v}" for k, v in cache_stats.items()))
+    use_store = st.toggle("♻️ 沿用已分析影片 (報告庫)", value=True, help="同一支影片、素材未變動時沿用先前的個別診斷，只分析新影片並重生 PART 2 / 3")
+    use_context_cache = st.toggle("🧊 追問沿用 Context Cache", value=True, help="分析完成後把媒體與報告建成 Gemini 快取，追問 / 腳本不再重送素材")
+    if not use_context_cache and st.session_state.context_cache:
+        # 關閉後立即釋放遠端快取 (否則會持續計費到 TTL 結束)，追問改走一般模式
+        drop_context_cache(st.session_state.context_cache)
+        st.session_state.context_cache = None
+    stream_mode = st.toggle("⚡ 串流輸出", value=True, help="邊生成邊顯示報告 / 腳本 / 對話")
+    with st.expander("💬 留言擷取 (YT)"):
+        comment_opts = {
+            "max_comments": st.slider("送入分析的留言數", 5, 100, 30),
+            "fetch_limit": st.number_input("抓取上限 (熱門排序)", 50, COMMENT_FETCH_MAX, COMMENT_FETCH_LIMIT, step=50),
+            "include_replies": st.toggle("包含回覆", value=False),
+            "timeout": st.slider("單支影片逾時 (秒)", 10, 300, 60),
+        }
+    with st.expander("🎞️ 媒體前處理 (ffmpeg)"):
+        if not ffmpeg_available(): st.caption("⚠️ 找不到 ffmpeg，將直接上傳原始檔")
+        yt_media_opts = {
+            "profile": st.selectbox("YT 音訊格式", list(AUDIO_PROFILES), index=1, format_func=PROFILE_LABELS.get),
+            "start": st.number_input("YT 起始秒數", 0, 36000, 0),
+            "duration": st.number_input("YT 擷取長度 (秒，0 = 全部)", 0, 36000, 0),
+        }
+        tt_media_opts = {
+            "profile": st.selectbox("TikTok 影片規格", list(VIDEO_PROFILES), index=1, format_func=PROFILE_LABELS.get),
+            "start": st.number_input("TikTok 起始秒數", 0, 3600, 0),
+            "duration": st.number_input("TikTok 擷取長度 (秒，0 = 全部)", 0, 3600, 0, help="例如只分析前 15 秒的鉤子片段"),
+        }
+    with st.expander("🖼️ 截圖前處理 (社群)"):
+        image_opts = {
+            "max_edge": st.select_slider("最長邊 (px)", [768, 1024, 1536, 2048, 3072], value=max_edge_for_model(base_model)),
+            "format": st.radio("編碼格式", list(IMAGE_FORMATS), horizontal=True),
+            "quality": st.slider("壓縮品質", 40, 95, DEFAULT_QUALITY),
+            "dedupe": st.toggle("略過重複截圖", value=True, help="以感知雜湊比對，幾乎相同的截圖只送一張"),
+        }
+    yt_workers = st.slider("⚡ 並行抓取數 (YT)", 1, 10, 4, help="同時抓取 Metadata / 留言 / 字幕 / 音訊的影片數量")
     st.markdown("---")
     st.caption("✅ 深度分析 Prompt (Deep Dive) 已恢復")
-
-# --- 工具函數 ---
-def format_timestamp(seconds):
-    return str(timedelta(seconds=int(seconds)))
-
-def calculate_days_ago(upload_date_str):
-    try:
-        if not upload_date_str: return "未知"
-        upload_dt = datetime.strptime(upload_date_str, "%Y%m%d")
-        now = datetime.now()
-        diff = now - upload_dt
-        days = diff.days
-        if days < 0: return "未來"
-        if days == 0: return "今天"
-        return f"{days} 天前"
-    except: return upload_date_str
-
-def upload_to_gemini(path, mime_type=None):
-    try:
-        if not mime_type:
-            if path.endswith('.mp4'): mime_type = 'video/mp4'
-            elif path.endswith('.mp3'): mime_type = 'audio/mp3'
-            elif path.endswith('.m4a'): mime_type = 'audio/mp4'
-        file = genai.upload_file(path, mime_type=mime_type)
-        timeout = 120 
-        while file.state.name == "PROCESSING" and timeout > 0:
-            time.sleep(1)
-            timeout -= 1
-            file = genai.get_file(file.name)
-        if file.state.name == "FAILED": return None
-        return file
-    except Exception as e: return None
-
-def get_yt_transcript(video_id):
-    try:
-        t = YouTubeTranscriptApi.get_transcript(video_id, languages=['zh-TW', 'zh', 'en'])
-        return "\n".join([f"[{format_timestamp(x['start'])}] {x['text']}" for x in t])
-    except: return None
-
-def get_yt_info(url):
-    ydl_opts = {'quiet': True, 'noplaylist': True, 'extract_flat': True}
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            return info
-    except: return None
-
-def get_video_comments(url, max_comments=30):
-    ydl_opts = {'quiet': True, 'noplaylist': True, 'extract_flat': False, 'getcomments': True, 'skip_download': True}
-    comments_text = []
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            comments = info.get('comments', [])
-            if not comments: return "無留言"
-            sorted_comments = sorted(comments, key=lambda x: x.get('like_count', 0), reverse=True)
-            for i, c in enumerate(sorted_comments[:max_comments]):
-                text = c.get('text', '')
-                if text: comments_text.append(f"👤 {c.get('author', 'User')}: {text}")
-        return "\n".join(comments_text)
-    except: return "留言讀取受限"
-
-def download_yt_audio(url, idx):
-    filename = f"yt_audio_{idx}_{int(time.time())}"
-    ydl_opts = {'format': 'bestaudio[ext=m4a]/bestaudio', 'outtmpl': filename + '.%(ext)s', 'quiet': True, 'ignoreerrors': True}
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl: ydl.download([url])
-        for ext in ['m4a', 'webm', 'mp3']:
-             if os.path.exists(f"{filename}.{ext}"): return f"{filename}.{ext}"
-        return None
-    except: return None
-
-def download_tiktok_video(url, idx):
-    filename = f"tt_video_{idx}_{int(time.time())}.mp4"
-    ydl_opts = {
-        'outtmpl': filename, 'format': 'best[ext=mp4]/best', 'quiet': True, 'ignoreerrors': True,
-        'http_headers': {'User-Agent': 'Mozilla/5.0 (Linux; Android 10; K)', 'Referer': 'https://www.tiktok.com/'}
-    }
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl: ydl.download([url])
-        if os.path.exists(filename): return filename
-        return None
-    except: return None
-
-# === 安全模型初始化 ===
-def get_model_with_fallback(model_name, use_search=False):
-    if not use_search: return genai.GenerativeModel(model_name)
-    try:
-        return genai.GenerativeModel(model_name, tools=[{'google_search': {}}])
-    except:
-        st.toast("⚠️ Search Tool 初始化失敗，已切換為標準模式。", icon="🔧")
-        return genai.GenerativeModel(model_name)
+    if st.session_state.latency_log:
+        last = st.session_state.latency_log[-1]
+        st.caption(f"⏱️ 上次 {last['task']} ({(last.get('model') or '').replace('models/', '')})：首字 {last['ttft']:.1f}s / 總計 {last['total']:.1f}s")
+    if st.session_state.perf_log:
+        perf = st.session_state.perf_log[-1]
+        st.caption(f"🚀 冷啟動 import {cold_start()['import_s']:.2f}s · 上次重跑 {perf['script_s']:.2f}s (首屏 {perf['paint_s']:.2f}s)")
 
 # ================= 主程式介面 =================
 st.title("TrendScope Pro | 深度回歸版")
@@ -224,20 +215,28 @@ st.markdown("### 🔴 YT 深度結構 | 🔵 TikTok 視覺分析 | 📸 社群
 tab_yt, tab_tt, tab_soc = st.tabs(["🔴 YouTube", "🔵 TikTok/Shorts", "📸 Threads/IG 圖文"])
 
 mode = ""
-data_inputs = []
-raw_context_builder = []
-temp_files = []
 
 # ================= TAB 1: YouTube =================
 with tab_yt:
-    c1, c2 = st.columns([1, 3])
-    with c1: num_yt = st.number_input("YT 數量", 1, 10, 1)
+    yt_source = st.radio("輸入方式", ["逐支網址", "頻道 / 播放清單 / 搜尋"], horizontal=True, key="yt_source")
     yt_urls = []
-    for i in range(num_yt):
+    discover_query = ""
+    if yt_source == "逐支網址":
+        c1, c2 = st.columns([1, 3])
+        with c1: num_yt = st.number_input("YT 數量", 1, 10, 1)
+        for i in range(num_yt):
+            st.markdown(f'<div class="yt-box">', unsafe_allow_html=True)
+            u = st.text_input(f"YouTube #{i+1}", key=f"yt_{i}")
+            if u: yt_urls.append(u)
+            st.markdown('</div>', unsafe_allow_html=True)
+    else:
         st.markdown(f'<div class="yt-box">', unsafe_allow_html=True)
-        u = st.text_input(f"YouTube #{i+1}", key=f"yt_{i}")
-        if u: yt_urls.append(u)
+        discover_query = st.text_input("頻道 / 播放清單網址、@handle 或搜尋關鍵字", key="yt_discover").strip()
         st.markdown('</div>', unsafe_allow_html=True)
+        c1, c2, c3 = st.columns(3)
+        with c1: discover_k = st.number_input("挑選前 K 支", 1, MAX_TOP_K, DEFAULT_TOP_K)
+        with c2: discover_rank = st.selectbox("排序依據", list(RANK_MODES), format_func=RANK_MODES.get)
+        with c3: discover_scan = st.number_input("最多掃描支數", 50, MAX_SCAN_LIMIT, DEFAULT_SCAN_LIMIT, step=50, help="只讀平面清單 (標題 / 觀看數 / 日期)，不逐支解析")
     st.markdown('<div class="btn-yt">', unsafe_allow_html=True)
     if st.button("🚀 執行 YouTube 深度分析", key="btn_run_yt"): mode = "youtube"
     st.markdown('</div>', unsafe_allow_html=True)
@@ -270,6 +269,8 @@ with tab_soc:
     st.markdown('</div>', unsafe_allow_html=True)
 
 # ================= 執行邏輯 =================
+paint_s = time.perf_counter() - _script_start
+
 if mode:
     if not api_key:
         st.error("請輸入 API Key")
@@ -279,148 +280,92 @@ if mode:
         st.session_state.gemini_files_list = []
         st.session_state.social_images_list = [] 
         st.session_state.generated_script = ""
+        st.session_state.run_id = None
+        drop_context_cache(st.session_state.context_cache)
+        st.session_state.context_cache = None
         
-        genai.configure(api_key=api_key)
+        configure_client(api_key)
+        registry_ns = registry_namespace(api_key)
         
-        use_search_in_analysis = (mode == "social")
-        model = get_model_with_fallback(selected_model, use_search=use_search_in_analysis)
+        report_box = st.empty()
 
-        with st.status("🚀 正在執行深度運算...", expanded=True) as status:
+        with st.status("🚀 正在執行深度運算...", expanded=True) as status, start_trace(f"run.{mode}", model=selected_model) as trace:
             try:
-                # --- YouTube (Prompt 大升級) ---
+                progress = lambda label: status.update(label=label, state="running")
                 if mode == "youtube":
-                    urls = [u for u in yt_urls if u.strip()]
-                    total = len(urls)
-                    for i, url in enumerate(urls):
-                        status.update(label=f"🔴 深度分析 YT #{i+1}...", state="running")
-                        info = get_yt_info(url)
-                        title = info['title'] if info else "Unknown"
-                        
-                        meta_str = f"\n=== YT #{i+1}: {title} ===\n"
-                        data_inputs.append(meta_str)
-                        raw_context_builder.append(meta_str)
-                        
-                        comments = get_video_comments(url)
-                        data_inputs.append(f"【YT #{i+1} 留言輿情】\n{comments}")
-                        raw_context_builder.append(f"留言摘要:\n{comments[:500]}...\n")
-
-                        transcript = None
-                        if "v=" in url or "youtu.be" in url:
-                            vid_match = re.search(r'(?:v=|\/)([0-9A-Za-z_-]{11})', url)
-                            if vid_match: transcript = get_yt_transcript(vid_match.group(1))
-                        
-                        use_audio = True
-                        if transcript:
-                            trans_str = f"【YT #{i+1} 字幕內容(含時間碼)】:\n{transcript[:35000]}"
-                            data_inputs.append(trans_str)
-                            raw_context_builder.append(trans_str + "\n")
-                            if token_saver_mode: use_audio = False
-
-                        if use_audio:
-                            status.update(label=f"🎧 下載音訊 #{i+1} (無字幕)...", state="running")
-                            aud_path = download_yt_audio(url, i)
-                            if aud_path:
-                                g_file = upload_to_gemini(aud_path)
-                                if g_file:
-                                    data_inputs.append(g_file)
-                                    st.session_state.gemini_files_list.append(g_file)
-                                    temp_files.append(aud_path)
-                                    raw_context_builder.append(f"[音訊掛載: {g_file.name}]")
-                    
-                    # === 恢復您最愛的深度 Prompt ===
-                    prompt = f"""
-                    **⚠️ 首席流量分析師指令 (SYSTEM OVERRIDE):**
-                    你現在是 YouTube 演算法與內容策略專家。請針對上述素材進行「深度拆解」。
-                    我們不要淺層摘要，我們要的是「為什麼會紅」的底層邏輯。
-
-                    請產出【TrendScope 深度結構報告】：
-
-                    ========================================
-                    PART 1: 🔬 個別深度診斷 (Deep Dive)
-                    ========================================
-                    (請針對每一支影片，結合 Metadata、字幕內容與網友留言進行分析)
-                    **📍 影片 #N - [標題]**
-                    - **內容核心與鉤子 (Hook)**: 前 15 秒到底做了什麼留住觀眾？(請引用畫面或台詞)
-                    - **流量歸因**: 是標題黨？還是內容乾貨？還是情緒共鳴？
-                    - **🗣️ 輿情真實風向**: 網友留言都在討論什麼？(支持/反對/玩梗/抓錯)
-                    - **⏱️ 高光時刻 (Highlights)**: 請列出 2-3 個最精彩的時間點 [MM:SS] 及其內容。
-
-                    ========================================
-                    PART 2: 🌪️ 流量密碼交叉比對 (Macro Analysis)
-                    ========================================
-                    ### 1. 📊 綜合比較矩陣
-                    | 影片標題 | 封面/選題策略 | 敘事節奏 | 觀眾情緒 | 爆紅指數 (1-5⭐) |
-
-                    ### 2. 🧠 共同爆款公式
-                    *   **選題邏輯**: 這些影片切中了什麼共同的人性弱點或需求？
-                    *   **結構共性**: 它們是否都用了類似的開場或結尾？
-
-                    ========================================
-                    PART 3: 💡 最佳執行建議 (Actionable Advice)
-                    ========================================
-                    若我要製作一支超越這些競品的影片，我應該：
-                    1. (具體建議)
-                    2. (具體建議)
-                    """
-
-                # --- TikTok ---
+                    if discover_query:
+                        progress("🔎 掃描候選影片...")
+                        found = discover_videos(discover_query, k=discover_k, rank_by=discover_rank, scan_limit=discover_scan)
+                        skipped = f"，{found['skipped']} 支缺少觀看數或日期未列入排名" if found["skipped"] else ""
+                        st.write(f"🔎 掃描 {found['scanned']} 支，挑出 {len(found['videos'])} 支{skipped}")
+                        st.dataframe([{"標題": v["title"], "頻道": v["channel"], "觀看數": v["view_count"], "上傳天數": v["days"], "每日觀看": v["velocity"]} for v in found["videos"]], hide_index=True, use_container_width=True)
+                        yt_urls = [v["url"] for v in found["videos"]]
+                    result = run_youtube_pipeline(
+                        yt_urls, token_saver=token_saver_mode, max_workers=yt_workers, use_cache=use_cache,
+                        registry_ns=registry_ns, progress=progress, token_budget=token_budget, comment_opts=comment_opts, media_opts=yt_media_opts,
+                    )
                 elif mode == "tiktok":
-                    total = len(tiktok_files_map)
-                    for i, (src_type, src_content) in enumerate(tiktok_files_map):
-                        status.update(label=f"🔵 分析 TikTok #{i+1}...", state="running")
-                        video_path = None
-                        if src_type == 'url':
-                            video_path = download_tiktok_video(src_content, i)
-                            if not video_path: 
-                                st.error(f"❌ #{i+1} 下載失敗，請改用上傳。")
-                                continue
-                            temp_files.append(video_path)
-                        elif src_type == 'file':
-                            video_path = f"upload_{i}_{int(time.time())}.mp4"
-                            with open(video_path, "wb") as f: f.write(src_content.getbuffer())
-                            temp_files.append(video_path)
-
-                        if video_path:
-                            status.update(label=f"👁️ 上傳影片 #{i+1}...", state="running")
-                            g_file = upload_to_gemini(video_path, mime_type='video/mp4')
-                            if g_file:
-                                data_inputs.append(f"【TikTok #{i+1}】(請觀看影片自訂標題)")
-                                data_inputs.append(g_file)
-                                st.session_state.gemini_files_list.append(g_file)
-                                raw_context_builder.append(f"\n=== TikTok #{i+1} ===\n[影片掛載: {g_file.name}]")
-                    prompt = """
-                    **TikTok 視覺分析指令:**
-                    請「觀看」上述影片並進行歸納。**請根據內容自動擬定標題**。
-                    PART 1: 👁️ 視覺矩陣 (AI Title | Visual Hook | BGM | Viral Factor)
-                    PART 2: ⚡ 短影音流量公式 (前3秒重點 / 節奏 / 引導)
-                    """
-
-                # --- Social ---
-                elif mode == "social":
-                    if txt_input: data_inputs.append(f"補充: {txt_input}")
-                    for i, img in enumerate(imgs_input):
-                        pil_img = Image.open(img)
-                        data_inputs.append(f"\n=== 圖片 #{i+1} ===\n")
-                        data_inputs.append(pil_img)
-                        st.session_state.social_images_list.append(pil_img)
-                    
-                    prompt = """
-                    **社群圖文分析:**
-                    請分析圖片的視覺重點與潛在情緒。
-                    **注意**：我已啟用 Google Search，若有必要請隨時查詢網路資訊。
-                    """
+                    result = run_tiktok_pipeline(tiktok_files_map, registry_ns=registry_ns, progress=progress, media_opts=tt_media_opts)
+                else:
+                    result = run_social_pipeline(imgs_input, note=txt_input, image_opts=image_opts, max_workers=yt_workers)
+                show_messages(result["messages"])
+                st.session_state.gemini_files_list = result["gemini_files"]
+                st.session_state.social_images_list = result["images"]
+                st.session_state.raw_context = "\n".join(result["raw_context"])
 
                 # --- Generate ---
-                if data_inputs:
+                if result["data_inputs"]:
+                    # 沿用報告庫的 PART 1 時，實際只送新影片素材與沿用的診斷
+                    contents, n_reused = report_contents(result, report_store if use_store else None)
+                    n_tokens, exact = count_tokens_or_estimate(model_factory(base_model), contents)
+                    budget_note = f"，沿用 {n_reused} 支既有診斷" if n_reused else ""
+                    if result["budget"] and result["budget"]["trimmed"]:
+                        budget_note += f"，原始 ≈ {result['budget']['before']:,}，已裁切 {result['budget']['trimmed']} 支影片"
+                    over_budget = bool(result["budget"] and result["budget"]["infeasible"])
+                    (st.warning if over_budget else st.info)(f"📏 輸入{'' if exact else '預估'} {n_tokens:,} tokens (預算 {token_budget:,}{budget_note}{'，無法壓到預算內' if over_budget else ''})")
                     status.update(label="🧠 AI 思考中...", state="running")
-                    response = smart_api_call(model.generate_content, data_inputs + [prompt])
-                    st.session_state.analysis_report = response.text
+                    report, latency = generate_report(selected_model, result, catalogue=catalogue, on_fallback=toast_search_fallback, stream=stream_mode, on_chunk=lambda t: report_box.markdown(t + " ▌"), on_wait=toast_api_wait, model_factory=model_factory, store=report_store if use_store else None)
+                    report_box.empty()
+                    log_latency(latency)
+                    st.session_state.analysis_report = report
+                    reuse = result.get("reuse")
+                    if reuse and reuse["reused"]: st.info(f"♻️ 沿用 {reuse['reused']} 支影片的既有診斷，只分析 {reuse['new']} 支新 / 變動影片")
+                    st.session_state.run_id = report_store.save_run(mode, latency.get("model") or selected_model, run_inputs(result), st.session_state.raw_context, report, title=txt_input if mode == "social" and txt_input else None)
+                    if use_context_cache:
+                        status.update(label="🧊 建立追問快取...", state="running")
+                        followup = build_followup_contents(result["gemini_files"], result["images"], report)
+                        st.session_state.context_cache = create_context_cache(resolve_models(selected_model, "chat", catalogue)[0], followup)
                     status.update(label="✅ 完成！", state="complete")
                 else:
                     st.error("無有效素材。")
 
             except Exception as e: st.error(f"錯誤: {e}")
-            for f in temp_files: safe_remove(f)
+        st.session_state.run_trace = trace.records()
+
+if st.session_state.run_trace:
+    with st.expander("⏱️ 本次執行時間軸"):
+        st.dataframe(timeline(st.session_state.run_trace), hide_index=True, use_container_width=True)
+        c1, c2 = st.columns(2)
+        c1.download_button("📥 匯出 JSON", json.dumps(st.session_state.run_trace, ensure_ascii=False, indent=2), "trace.json", "application/json")
+        c2.download_button("📥 匯出 OTLP", json.dumps(to_otlp(st.session_state.run_trace)), "trace_otlp.json", "application/json")
+
+with st.expander("🗂️ 歷史報告"):
+    history_query = st.text_input("搜尋報告 / 腳本", placeholder="輸入關鍵字，留空顯示最近的分析")
+    for hit in report_store.search(history_query):
+        c1, c2 = st.columns([5, 1])
+        c1.markdown(f"**{hit['title']}** · {hit['mode']} · {datetime.fromtimestamp(hit['created']):%Y-%m-%d %H:%M}" + (f"\n\n{hit['snippet']}" if hit["snippet"] else ""))
+        if c2.button("載入", key=f"load_run_{hit['id']}"):
+            run = report_store.get_run(hit["id"])
+            st.session_state.analysis_report = run["report"]
+            st.session_state.raw_context = run["raw_context"]
+            st.session_state.generated_script = run["scripts"][-1] if run["scripts"] else ""
+            st.session_state.run_id = run["id"]
+            # 歷史紀錄沒有可用的媒體檔，追問只帶報告
+            st.session_state.gemini_files_list = []
+            st.session_state.social_images_list = []
+            drop_context_cache(st.session_state.context_cache)
+            st.session_state.context_cache = None
+            st.rerun()
 
 # ================= 結果區 =================
 if st.session_state.analysis_report:
@@ -454,15 +399,21 @@ if st.session_state.analysis_report:
 
         if st.button("✨ 生成客製化腳本"):
             with st.spinner("撰寫中..."):
-                s_model = get_model_with_fallback(selected_model, use_search=False)
                 s_prompt = f"""
                 **專業編劇指令:**
                 參考報告，寫一個 {s_duration} 的 {s_style} 腳本。
                 角色：{chr(10).join(actors_info)}
                 格式：Markdown 表格
                 """
-                res = smart_api_call(s_model.generate_content, f"報告:\n{st.session_state.analysis_report}\n指令:\n{s_prompt}")
-                st.session_state.generated_script = res.text
+                script_box = st.empty()
+                on_chunk = lambda t: script_box.markdown(t + " ▌")
+                script, latency = followup_from_cache(api_key, f"指令:\n{s_prompt}", "script", stream_mode, on_chunk)
+                if script is None:
+                    script, latency = generate_routed(selected_model, f"報告:\n{st.session_state.analysis_report}\n指令:\n{s_prompt}", task="script", catalogue=catalogue, stream=stream_mode, on_chunk=on_chunk, on_wait=toast_api_wait, model_factory=model_factory)
+                script_box.empty()
+                log_latency(latency)
+                st.session_state.generated_script = script
+                if st.session_state.run_id: report_store.add_script(st.session_state.run_id, s_prompt, script)
         st.markdown('</div>', unsafe_allow_html=True)
 
     if st.session_state.generated_script:
@@ -476,25 +427,16 @@ if st.session_state.analysis_report:
         with st.chat_message("user"): st.markdown(prompt)
         with st.chat_message("assistant"):
             with st.spinner("思考/搜尋中..."):
-                chat_model = get_model_with_fallback(selected_model, use_search=True)
-                
-                chat_inputs = []
-                
-                # 放入所有媒體檔案 (YT/TikTok)
-                if st.session_state.gemini_files_list:
-                    for i, f in enumerate(st.session_state.gemini_files_list):
-                        chat_inputs.append(f"【媒體 #{i+1}】")
-                        chat_inputs.append(f)
-                
-                # 放入所有社群圖片 (Social)
-                if st.session_state.social_images_list:
-                    for i, img in enumerate(st.session_state.social_images_list):
-                        chat_inputs.append(f"【圖片 #{i+1}】")
-                        chat_inputs.append(img)
-                
-                chat_inputs.append(f"【報告】\n{st.session_state.analysis_report}")
-                chat_inputs.append(f"【問題】{prompt}")
-                chat_inputs.append("若使用者詢問人物身分或地點，請務必使用 Google Search 查詢並提供 Wiki 或新聞連結。")
-                
-                res = smart_api_call(chat_model.generate_content, chat_inputs).text
-                st.markdown(res)
\ No newline at end of file
+                chat_box = st.empty()
+                on_chunk = lambda t: chat_box.markdown(t + " ▌")
+                res, latency = followup_from_cache(api_key, [f"【問題】{prompt}", SEARCH_INSTRUCTION], "chat", stream_mode, on_chunk)
+                if res is None:
+                    # 放入所有媒體檔案 (YT/TikTok)、社群圖片 (Social) 與報告
+                    chat_inputs = build_followup_contents(st.session_state.gemini_files_list, st.session_state.social_images_list, st.session_state.analysis_report)
+                    chat_inputs.append(f"【問題】{prompt}")
+                    chat_inputs.append(SEARCH_INSTRUCTION)
+                    res, latency = generate_routed(selected_model, chat_inputs, task="chat", catalogue=catalogue, use_search=True, on_fallback=toast_search_fallback, stream=stream_mode, on_chunk=on_chunk, on_wait=toast_api_wait, model_factory=model_factory)
+                chat_box.markdown(res)
+                log_latency(latency)
+
+record_perf(paint_s)
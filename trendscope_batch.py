@@ -0,0 +1,161 @@
+"""TrendScope 批次執行器 (無 UI)。
+
+用法:
+    python trendscope_batch.py urls.txt -o out/ --group-size 5
+    python trendscope_batch.py jobs.jsonl -o out/ --workers 4
+
+輸入檔:
+    .txt   每行一個 YouTube 網址 (# 開頭為註解)，依 --group-size 分組成工作
+    .jsonl 每行一個工作: {"id": "...", "mode": "youtube|tiktok|social", "urls": [...], "note": "..."}
+           tiktok 的 urls 可為網址或本機 mp4 路徑；social 的 urls 為圖片路徑
+           youtube 工作可改給 {"discover": "頻道 / 播放清單網址、@handle 或關鍵字", "top_k": 5, "rank_by": "velocity"}，
+           先掃描平面清單再挑出前 K 支分析 (未指定時用 --top-k / --rank-by / --scan-limit)
+
+每個工作輸出到 <out>/<id>/ (report.md, raw_context.txt, job.json, trace_otlp.json)，
+完成狀態記錄在 <out>/checkpoint.jsonl；中斷後以相同指令重跑即從未完成的工作續跑。
+報告同時存進本機報告庫 (與 UI 共用)，YT 工作會沿用已分析過影片的 PART 1 (--no-store 關閉)。
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import google.generativeai as genai
+
+from trendscope_core import DEFAULT_MODEL, COMMENT_FETCH_LIMIT, COMMENT_FETCH_MAX, registry_namespace, run_analysis
+from trendscope_media import AUDIO_PROFILES, VIDEO_PROFILES
+from trendscope_workspace import sweep_orphans
+from trendscope_trace import start_trace, to_otlp
+from trendscope_reports import get_report_store
+from trendscope_discovery import DEFAULT_TOP_K, DEFAULT_SCAN_LIMIT, RANK_MODES, discover_videos
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+MODES = ("youtube", "tiktok", "social")
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")  # id 直接當輸出子目錄名稱，不允許路徑分隔或 ".."
+
+def job_id_for(mode, urls):
+    # 未指定 id 時以內容決定，重跑時才能對上 checkpoint
+    return f"{mode}-" + hashlib.sha1("\n".join([mode] + urls).encode()).hexdigest()[:12]
+
+def load_jobs(path, group_size=1, mode="youtube"):
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+    if path.endswith(".jsonl"):
+        for n, line in enumerate(lines, 1):
+            job = json.loads(line)
+            job_mode = job.get("mode", mode)
+            if job_mode not in MODES: raise ValueError(f"第 {n} 行: 未知模式 {job_mode}")
+            urls = job.get("urls") or ([job["url"]] if job.get("url") else [])
+            discover = {k: job[k] for k in ("discover", "top_k", "rank_by", "scan_limit") if k in job}
+            if discover and job_mode != "youtube": raise ValueError(f"第 {n} 行: discover 只支援 youtube 模式")
+            if discover.get("rank_by", "velocity") not in RANK_MODES: raise ValueError(f"第 {n} 行: 未知排序 {discover['rank_by']}")
+            if job.get("id") and (not JOB_ID_PATTERN.match(str(job["id"])) or set(str(job["id"])) == {"."}):
+                raise ValueError(f"第 {n} 行: id 只能包含英數字與 . _ -: {job['id']!r}")
+            key = urls or [f"{k}={v}" for k, v in sorted(discover.items())]
+            jobs.append({"id": job.get("id") or job_id_for(job_mode, key), "mode": job_mode, "urls": urls, "note": job.get("note", ""), **discover})
+    else:
+        for start in range(0, len(lines), group_size):
+            urls = lines[start:start + group_size]
+            jobs.append({"id": job_id_for(mode, urls), "mode": mode, "urls": urls, "note": ""})
+    return jobs
+
+def load_checkpoint(out_dir):
+    done = set()
+    path = os.path.join(out_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path): return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try: entry = json.loads(line)
+            except json.JSONDecodeError: continue  # 中斷時可能寫到一半
+            if entry.get("status") == "done": done.add(entry["id"])
+    return done
+
+def job_sources(job):
+    if job["mode"] == "tiktok":
+        return [('path', u) if os.path.exists(u) else ('url', u) for u in job["urls"]]
+    return job["urls"]
+
+def run_job(job, out_dir, args, registry_ns):
+    job_dir = os.path.join(out_dir, job["id"])
+    os.makedirs(job_dir, exist_ok=True)
+    start = time.time()
+    with start_trace(f"batch.{job['mode']}", job_id=job["id"]) as trace:
+        if job.get("discover"):
+            found = discover_videos(job["discover"], k=job.get("top_k", args.top_k), rank_by=job.get("rank_by", args.rank_by), scan_limit=job.get("scan_limit", args.scan_limit))
+            job = dict(job, urls=[v["url"] for v in found["videos"]], discovered={k: found[k] for k in ("source", "scanned", "skipped", "videos")})
+        result = run_analysis(
+            job["mode"], job_sources(job), model_name=args.model, note=job["note"], token_saver=not args.no_token_saver,
+            max_workers=args.fetch_workers, use_cache=not args.no_cache, registry_ns=registry_ns,
+            comment_opts={"max_comments": args.comments, "fetch_limit": args.comment_fetch_limit, "include_replies": args.comment_replies, "timeout": args.comment_timeout},
+            media_opts={"profile": args.video_profile if job["mode"] == "tiktok" else args.audio_profile, "start": args.clip_start, "duration": args.clip_duration},
+            store=None if args.no_store else get_report_store(),
+        )
+    # OTLP/JSON，可直接送進 OpenTelemetry Collector 彙整各工作的階段耗時
+    with open(os.path.join(job_dir, "trace_otlp.json"), "w", encoding="utf-8") as f: json.dump(to_otlp(trace.records()), f)
+    if not result["report"]: raise RuntimeError("無有效素材")
+    with open(os.path.join(job_dir, "report.md"), "w", encoding="utf-8") as f: f.write(result["report"])
+    with open(os.path.join(job_dir, "raw_context.txt"), "w", encoding="utf-8") as f: f.write("\n".join(result["raw_context"]))
+    meta = dict(job, model=args.model, elapsed=round(time.time() - start, 2), latency=result["latency"], messages=result["messages"], run_id=result.get("run_id"), reuse=result.get("reuse"))
+    with open(os.path.join(job_dir, "job.json"), "w", encoding="utf-8") as f: json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TrendScope 批次分析")
+    parser.add_argument("input", help="網址清單 (.txt) 或工作檔 (.jsonl)")
+    parser.add_argument("-o", "--out", default="trendscope_out", help="輸出目錄")
+    parser.add_argument("--mode", choices=MODES, default="youtube", help=".txt 輸入的分析模式")
+    parser.add_argument("--group-size", type=int, default=1, help=".txt 每個工作包含的網址數 (1-10)")
+    parser.add_argument("--workers", type=int, default=2, help="同時執行的工作數")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="單一工作內的並行抓取數")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="模型名稱；auto = 依任務自動挑選並在限流時切換")
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY", ""))
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="discover 工作挑選的影片數 (1-10)")
+    parser.add_argument("--rank-by", choices=list(RANK_MODES), default="velocity", help="discover 工作的排序依據")
+    parser.add_argument("--scan-limit", type=int, default=DEFAULT_SCAN_LIMIT, help="discover 工作最多掃描的候選影片數")
+    parser.add_argument("--no-cache", action="store_true", help="略過本機快取")
+    parser.add_argument("--no-store", action="store_true", help="不寫入報告庫、不沿用先前的 PART 1")
+    parser.add_argument("--no-token-saver", action="store_true", help="有字幕時仍下載音訊")
+    parser.add_argument("--audio-profile", choices=list(AUDIO_PROFILES), default="opus16k", help="YT 音訊前處理")
+    parser.add_argument("--video-profile", choices=list(VIDEO_PROFILES), default="720p15", help="TikTok 影片前處理")
+    parser.add_argument("--clip-start", type=int, default=0, help="只擷取從此秒數開始的片段")
+    parser.add_argument("--clip-duration", type=int, default=0, help="擷取長度秒數 (0 = 全部)")
+    parser.add_argument("--comments", type=int, default=30, help="每支影片送入分析的留言數")
+    parser.add_argument("--comment-fetch-limit", type=int, default=COMMENT_FETCH_LIMIT, help=f"每支影片最多抓取的熱門留言數 (上限 {COMMENT_FETCH_MAX})")
+    parser.add_argument("--comment-replies", action="store_true", help="留言包含回覆")
+    parser.add_argument("--comment-timeout", type=int, default=60, help="單支影片留言擷取逾時秒數，逾時即中止擷取")
+    args = parser.parse_args(argv)
+
+    if not args.api_key: parser.error("請以 --api-key 或 GOOGLE_API_KEY 提供 API Key")
+    genai.configure(api_key=args.api_key)
+    os.makedirs(args.out, exist_ok=True)
+    sweep_orphans()
+
+    jobs = load_jobs(args.input, group_size=max(1, min(args.group_size, 10)), mode=args.mode)
+    done = load_checkpoint(args.out)
+    todo = [j for j in jobs if j["id"] not in done]
+    print(f"共 {len(jobs)} 個工作，已完成 {len(jobs) - len(todo)}，本次執行 {len(todo)}", file=sys.stderr)
+
+    registry_ns = registry_namespace(args.api_key)
+    failed = 0
+    with open(os.path.join(args.out, CHECKPOINT_FILE), "a", encoding="utf-8") as ckpt, ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(run_job, job, args.out, args, registry_ns): job for job in todo}
+        for n, fut in enumerate(as_completed(futures), 1):
+            job = futures[fut]
+            try:
+                meta = fut.result()
+                entry = {"id": job["id"], "status": "done", "elapsed": meta["elapsed"]}
+            except Exception as e:
+                failed += 1
+                entry = {"id": job["id"], "status": "failed", "error": str(e)}
+            ckpt.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            ckpt.flush()
+            print(f"[{n}/{len(todo)}] {job['id']}: {entry['status']}", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
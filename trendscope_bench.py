@@ -0,0 +1,336 @@
+"""TrendScope 離線效能基準 (不需網路、不需 API Key)。
+
+用法:
+    python trendscope_bench.py
+    python trendscope_bench.py --sizes 1 4 16 --latency-scale 0.2 --json bench.json
+
+以 bench_fixtures/recorded.json 的錄製資料 (Metadata / 留言 / 字幕 / 媒體大小 / 各呼叫延遲)
+取代 yt_dlp、youtube_transcript_api 與 google.generativeai；假呼叫依錄製延遲 × --latency-scale 睡眠後回放。
+對每個批量跑 YouTube / TikTok / 社群管線 (含報告生成) 與 create_word_docx，
+回報牆鐘時間、峰值 RSS、各階段呼叫次數，以及上傳 / 送入 generate_content 的資料量。
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import Counter
+from io import BytesIO
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixtures", "recorded.json")
+DEFAULT_SIZES = (1, 5, 10)
+RSS_SAMPLE_INTERVAL = 0.01
+
+class Recorder:
+    """各假呼叫的次數與資料量；多執行緒共用"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, stage, n=1):
+        with self._lock: self.counts[stage] += n
+
+    def reset(self):
+        with self._lock:
+            snapshot = dict(self.counts)
+            self.counts.clear()
+        return snapshot
+
+# ================= 假模組 =================
+def _video_id(url):
+    return url.split("v=")[-1][:11] if "v=" in url else url.rstrip("/").rsplit("/", 1)[-1]
+
+def make_fake_ytdlp(fx, rec, sleep):
+    class YoutubeDL:
+        def __init__(self, opts=None):
+            self.opts = opts or {}
+
+        def __enter__(self): return self
+        def __exit__(self, *exc): return False
+
+        def extract_info(self, url, download=False, process=True):
+            if self.opts.get("extract_flat") == "in_playlist": return {"_type": "playlist", "entries": self._flat_entries(url)}
+            vid = _video_id(url)
+            info = dict(fx["info"], id=vid, webpage_url=url)
+            if not self.opts.get("getcomments"):
+                rec.add("yt_dlp.info")
+                sleep("info")
+                return info
+            rec.add("yt_dlp.comments")
+            sleep("comments")
+            comments = fx["comments"]
+            max_comments = self.opts.get("extractor_args", {}).get("youtube", {}).get("max_comments")
+            if max_comments: comments = comments[:int(max_comments[0])]
+            return dict(info, comments=[dict(c) for c in comments])
+
+        def _flat_entries(self, url):
+            # 探索模式的平面清單：觀看數與上傳日期以網址為種子產生，同一來源每次結果相同
+            rng = random.Random(url)
+            today = time.time()
+            for n in itertools.count(1):
+                if n % 50 == 1:
+                    rec.add("yt_dlp.flat_page")
+                    sleep("flat_page")
+                upload = time.strftime("%Y%m%d", time.localtime(today - rng.randint(0, 365) * 86400))
+                yield {"_type": "url", "ie_key": "Youtube", "id": f"bench{n:06d}", "url": f"https://www.youtube.com/watch?v=bench{n:06d}",
+                       "title": f"{fx['info']['title']} #{n}", "channel": fx["info"]["channel"],
+                       "view_count": int(fx["info"]["view_count"] * rng.lognormvariate(0, 1.5)), "upload_date": upload}
+
+        def download(self, urls):
+            for url in urls:
+                rec.add("yt_dlp.download")
+                sleep("download")
+                tiktok = "tiktok" in url
+                size = fx["media"]["video_bytes" if tiktok else "audio_bytes"]
+                if self.opts.get("max_filesize") and size > self.opts["max_filesize"]: continue
+                path = self.opts["outtmpl"].replace("%(ext)s", "m4a")
+                with open(path, "wb") as f: f.write(os.urandom(size))
+                rec.add("yt_dlp.download_bytes", size)
+            return 0
+
+    return types.SimpleNamespace(YoutubeDL=YoutubeDL)
+
+def make_fake_transcript_api(fx, rec, sleep, no_transcript_every):
+    class YouTubeTranscriptApi:
+        @staticmethod
+        def get_transcript(video_id, languages=None):
+            rec.add("transcript.get")
+            sleep("transcript")
+            # 每 N 支影片中有一支沒有字幕，讓 Token 節約模式也會走到下載 / 上傳音訊
+            if no_transcript_every and int(video_id[-6:]) % no_transcript_every == 0: raise RuntimeError("No transcript")
+            return [dict(x) for x in fx["transcript"]]
+
+    return types.SimpleNamespace(YouTubeTranscriptApi=YouTubeTranscriptApi)
+
+def _payload_bytes(contents):
+    if isinstance(contents, str): return len(contents.encode())
+    total = 0
+    for part in contents:
+        if isinstance(part, str): total += len(part.encode())
+        elif isinstance(part, dict): total += len(part.get("data") or b"")
+    return total
+
+def make_fake_genai(fx, rec, sleep, latency_scale=1.0):
+    files = {}
+    lock = threading.Lock()
+    seq = iter(range(1, 1 << 30))
+
+    class State:
+        def __init__(self, name): self.name = name
+
+    class File:
+        def __init__(self, name, mime_type):
+            self.name, self.mime_type, self.expiration_time = name, mime_type, None
+            # 伺服器端處理時間同樣依 --latency-scale 縮放
+            self.ready_at = time.time() + fx["latency"]["processing"] * latency_scale
+
+        @property
+        def state(self):
+            return State("ACTIVE" if time.time() >= self.ready_at else "PROCESSING")
+
+    def configure(api_key=None, **kwargs): pass
+
+    def upload_file(payload, mime_type=None):
+        rec.add("genai.upload")
+        if isinstance(payload, str): size = os.path.getsize(payload)
+        else: size = len(payload.getvalue())
+        rec.add("genai.upload_bytes", size)
+        sleep("upload")
+        with lock:
+            f = File(f"files/bench-{next(seq)}", mime_type)
+            files[f.name] = f
+        return f
+
+    def get_file(name):
+        rec.add("genai.get_file")
+        sleep("get_file")
+        with lock: return files[name]
+
+    def list_models():
+        return [types.SimpleNamespace(name="models/gemini-1.5-flash", supported_generation_methods=["generateContent"], input_token_limit=1_000_000, output_token_limit=8192)]
+
+    class Chunk:
+        def __init__(self, text): self.text = text
+
+    class GenerativeModel:
+        def __init__(self, model_name="models/gemini-1.5-flash", tools=None, **kwargs):
+            self.model_name = model_name
+
+        @classmethod
+        def from_cached_content(cls, cached_content=None):
+            return cls()
+
+        def count_tokens(self, contents):
+            raise RuntimeError("offline")
+
+        def _report(self, contents):
+            # 依素材中的 "=== YT #N" 等標記編號，報告庫才能拆出各影片的 PART 1
+            parts = [contents] if isinstance(contents, str) else [p for p in contents if isinstance(p, str)]
+            found = [m for p in parts for m in re.findall(r"=== (?:YT|TikTok|圖片) #(\d+)(?:: (.*?))? ===", p)] or [("1", "")]
+            r = fx["report"]
+            return r["header"] + "".join(r["section"].replace("#N", f"#{n}").replace("{title}", title or "影片") for n, title in found) + r["footer"]
+
+        def generate_content(self, contents, stream=False):
+            rec.add("genai.generate")
+            rec.add("genai.generate_payload_bytes", _payload_bytes(contents))
+            text = self._report(contents)
+            if not stream:
+                sleep("generate")
+                return Chunk(text)
+            def _stream():
+                sleep("ttft")
+                pieces = [text[i:i + 200] for i in range(0, len(text), 200)]
+                rest = max(0.0, fx["latency"]["generate"] - fx["latency"]["ttft"])
+                for piece in pieces:
+                    yield Chunk(piece)
+                    sleep(None, rest / len(pieces))
+            return _stream()
+
+    class CachedContent:
+        @staticmethod
+        def create(**kwargs): raise RuntimeError("offline")
+
+    genai = types.ModuleType("google.generativeai")
+    genai.configure, genai.upload_file, genai.get_file, genai.list_models, genai.GenerativeModel = configure, upload_file, get_file, list_models, GenerativeModel
+    genai.caching = types.SimpleNamespace(CachedContent=CachedContent)
+    return genai
+
+def install_fakes(fx, rec, latency_scale=1.0, no_transcript_every=2):
+    """必須在 import trendscope_core 之前呼叫"""
+    def sleep(stage, seconds=None):
+        seconds = fx["latency"][stage] if stage else seconds
+        if seconds and latency_scale: time.sleep(seconds * latency_scale)
+    genai = make_fake_genai(fx, rec, sleep, latency_scale)
+    google = sys.modules.get("google") or types.ModuleType("google")
+    google.generativeai = genai
+    sys.modules.update({
+        "google": google, "google.generativeai": genai, "google.generativeai.caching": genai.caching,
+        "yt_dlp": make_fake_ytdlp(fx, rec, sleep),
+        "youtube_transcript_api": make_fake_transcript_api(fx, rec, sleep, no_transcript_every),
+    })
+
+# ================= 量測 =================
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource  # 非 Linux：只能取得行程至今的峰值
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class PeakRss:
+    """背景取樣 RSS，記錄區間內相對於開始時的峰值增量"""
+    def __enter__(self):
+        self.base = self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL): self.peak = max(self.peak, _rss_bytes())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+        return False
+
+def measure(name, size, rec, func):
+    rec.reset()
+    start = time.perf_counter()
+    with PeakRss() as rss:
+        error = None
+        try: func()
+        except Exception as e: error = f"{type(e).__name__}: {e}"
+    return {
+        "stage": name, "size": size, "wall_s": round(time.perf_counter() - start, 3),
+        "peak_rss_mb": round(rss.peak / 1024 ** 2, 1), "rss_delta_mb": round((rss.peak - rss.base) / 1024 ** 2, 1),
+        "calls": rec.reset(), "error": error,
+    }
+
+def make_images(fx, n, seed=0):
+    from PIL import Image
+    w, h = fx["media"]["image_size"]
+    rnd = random.Random(seed)
+    images = []
+    for i in range(n):
+        # 每張不同的粗格色塊，避免被去重；尺寸比照手機截圖
+        small = Image.new("RGB", (16, 32))
+        small.putdata([tuple(rnd.randrange(256) for _ in range(3)) for _ in range(16 * 32)])
+        buf = BytesIO()
+        small.resize((w, h), Image.NEAREST).save(buf, format="PNG")
+        images.append(buf.getvalue())
+    return images
+
+def run_benchmark(sizes, fx, rec, fetch_workers=4, latency_scale=1.0):
+    # install_fakes 之後才能載入，trendscope_core 拿到的才會是假模組
+    import trendscope_core as core
+    from trendscope_quota import scheduler
+    scheduler.configure(core.DEFAULT_MODEL, 1_000_000, 10 ** 12)  # 不讓限流器影響量測
+    # 處理狀態輪詢的間隔跟著縮放並關閉抖動，牆鐘時間才不會混進隨機睡眠
+    core.GEMINI_POLL_BASE_DELAY *= latency_scale
+    core.GEMINI_POLL_MAX_DELAY *= latency_scale
+    core.GEMINI_POLL_JITTER = (1.0, 1.0)
+    rows = []
+    for size in sizes:
+        ns = f"bench-{size}-{time.time_ns()}"  # 每輪獨立的上傳登錄表，避免沿用前一輪的檔案
+        urls = [f"https://www.youtube.com/watch?v=bench{n:06d}" for n in range(1, size + 1)]
+        tiktoks = [("url", f"https://www.tiktok.com/@bench/video/{n}") for n in range(1, size + 1)]
+        images = make_images(fx, size, seed=size)
+        report = {}
+
+        def yt():
+            result = core.run_youtube_pipeline(urls, token_saver=True, max_workers=fetch_workers, use_cache=False, registry_ns=ns, media_opts={"profile": "original"})
+            report["text"], _ = core.generate_report(core.DEFAULT_MODEL, result, stream=True)
+        def tiktok():
+            result = core.run_tiktok_pipeline(tiktoks, registry_ns=ns, media_opts={"profile": "original"})
+            core.generate_report(core.DEFAULT_MODEL, result, stream=True)
+        def social():
+            result = core.run_social_pipeline(images, note="bench", max_workers=fetch_workers)
+            core.generate_report(core.DEFAULT_MODEL, result, stream=True)
+        def docx():
+            core.create_word_docx(report.get("text") or "", "分析報告")
+
+        for name, func in (("youtube", yt), ("tiktok", tiktok), ("social", social), ("docx", docx)):
+            row = measure(name, size, rec, func)
+            rows.append(row)
+            print(format_row(row), file=sys.stderr)
+    return rows
+
+def format_row(row):
+    calls = " ".join(f"{k}={v}" for k, v in sorted(row["calls"].items()) if not k.endswith("_bytes"))
+    sizes = " ".join(f"{k}={v / 1024:.0f}KB" for k, v in sorted(row["calls"].items()) if k.endswith("_bytes"))
+    line = f"{row['stage']:<8} n={row['size']:<3} {row['wall_s']:>8.2f}s  rss {row['peak_rss_mb']:>7.1f}MB (+{row['rss_delta_mb']:.1f})  {calls}  {sizes}"
+    return line + (f"  ❌ {row['error']}" if row["error"] else "")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TrendScope 離線效能基準")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="每種管線的批量 (影片 / 圖片數)")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH, help="錄製資料 JSON")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="錄製延遲的倍率 (0 = 不睡眠，只量 CPU / 記憶體)")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="YT 並行抓取數 / 圖片前處理執行緒數")
+    parser.add_argument("--no-transcript-every", type=int, default=2, help="每 N 支影片有一支沒有字幕 (0 = 全部有字幕)")
+    parser.add_argument("--json", help="另存結果為 JSON")
+    args = parser.parse_args(argv)
+    if args.json: args.json = os.path.abspath(args.json)
+
+    with open(args.fixtures, encoding="utf-8") as f: fx = json.load(f)
+    rec = Recorder()
+    install_fakes(fx, rec, latency_scale=args.latency_scale, no_transcript_every=args.no_transcript_every)
+    # 本機快取 / 暫存檔都放在拋棄式目錄，不碰使用者的 trendscope_cache.db
+    with tempfile.TemporaryDirectory(prefix="trendscope_bench_") as tmp:
+        os.chdir(tmp)
+        rows = run_benchmark(sorted(set(args.sizes)), fx, rec, fetch_workers=args.fetch_workers, latency_scale=args.latency_scale)
+    for row in rows: print(format_row(row))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(rows, f, ensure_ascii=False, indent=2)
+    return 1 if any(row["error"] for row in rows) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Token 預算：送出 generate_content 前估算輸入量，並把每支影片的字幕 / 留言裁到預算內。
+
+估算為本機近似值 (不呼叫 API)：中日韓文字約 1 字 1 token，其他約 4 字元 1 token；
+媒體依 Gemini 官方換算 (音訊 32 token/秒、影片約 263 token/秒、圖片 258 token)。
+需要精確值時可用 count_tokens_or_estimate 走 model.count_tokens。
+"""
+import re
+
+AUDIO_TOKENS_PER_SEC = 32
+VIDEO_TOKENS_PER_SEC = 263
+IMAGE_TOKENS = 258
+DEFAULT_MEDIA_SECONDS = 60
+HOOK_SECONDS = 15
+COMMENT_SHARE = 0.25
+MIN_COMMENTS = 3              # 預算再緊也保留的熱門留言則數
+MIN_TRANSCRIPT_TOKENS = 200   # 預算再緊也保留的字幕量 (足以涵蓋開頭鉤子)
+
+# (模型名稱關鍵字, 單次分析的預設輸入預算)；遠低於模型上下文上限，避免為用不到的 token 付費
+MODEL_BUDGETS = [
+    ("1.5-pro", 400_000),
+    ("flash-8b", 120_000),
+    ("flash", 250_000),
+]
+FALLBACK_BUDGET = 120_000
+
+_CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+_TS_LINE = re.compile(r"^\[(\d+):(\d{2}):(\d{2})\]")
+_COMMENT_ENTRY = re.compile(r"\n(?=(?:↳ )?👤 )")  # 每則留言以 "👤 作者:" 開頭，內文本身可能含換行
+
+def default_budget(model_name):
+    for keyword, budget in MODEL_BUDGETS:
+        if keyword in model_name: return budget
+    return FALLBACK_BUDGET
+
+def estimate_tokens(text):
+    if not text: return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def media_tokens(mime_type, seconds=None):
+    seconds = seconds or DEFAULT_MEDIA_SECONDS
+    if mime_type.startswith("video"): return int(seconds * VIDEO_TOKENS_PER_SEC)
+    if mime_type.startswith("audio"): return int(seconds * AUDIO_TOKENS_PER_SEC)
+    return IMAGE_TOKENS
+
+def estimate_part(part):
+    if isinstance(part, str): return estimate_tokens(part)
+    if isinstance(part, dict): return media_tokens(part.get("mime_type", "image/"))
+    mime = getattr(part, "mime_type", None)
+    if mime:
+        meta = getattr(part, "video_metadata", None)
+        seconds = getattr(getattr(meta, "video_duration", None), "seconds", None) if meta else None
+        return media_tokens(mime, seconds)
+    return IMAGE_TOKENS  # PIL 圖片等
+
+def estimate_contents(contents):
+    if isinstance(contents, str): return max(1, estimate_tokens(contents))
+    return max(1, sum(estimate_part(p) for p in contents))
+
+def count_tokens_or_estimate(model, contents):
+    """優先用 API 計數，失敗 (離線 / 模型不支援) 時退回本機估算；回傳 (tokens, 是否精確)"""
+    try: return model.count_tokens(contents).total_tokens, True
+    except Exception: return estimate_contents(contents), False
+
+def allocate_budget(needs, total):
+    """水位分配：需求小的影片拿多少算多少，剩下的平均分給其餘影片"""
+    alloc = [0] * len(needs)
+    remaining = max(0, total)
+    order = sorted(range(len(needs)), key=lambda i: needs[i])
+    for n, i in enumerate(order):
+        share = remaining // (len(order) - n)
+        alloc[i] = min(needs[i], share)
+        remaining -= alloc[i]
+    return alloc
+
+def _line_seconds(line):
+    m = _TS_LINE.match(line)
+    return int(m.group(1)) * 3600 + int(m.group(2)) * 60 + int(m.group(3)) if m else None
+
+def trim_transcript(transcript, max_tokens, hook_seconds=HOOK_SECONDS):
+    """保留開頭 hook_seconds 秒 (鉤子) 的完整字幕，其餘均勻取樣到預算內"""
+    if not transcript or estimate_tokens(transcript) <= max_tokens: return transcript
+    if max_tokens <= 0: return ""
+    lines = transcript.split("\n")
+    n_hook = 0
+    while n_hook < len(lines) and (_line_seconds(lines[n_hook]) or 0) <= hook_seconds: n_hook += 1
+    hook, rest = lines[:n_hook], lines[n_hook:]
+    kept, used = [], 0
+    for line in hook:
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens: break
+        kept.append(line)
+        used += cost
+    remaining = max_tokens - used
+    if rest and remaining > 0:
+        avg = max(1, (estimate_tokens("\n".join(rest)) + len(rest)) / len(rest))
+        k = min(len(rest), int(remaining // avg))
+        if k > 0:
+            kept.append(f"…(以下字幕均勻取樣 {k}/{len(rest)} 行)")
+            kept.extend(rest[int(j * len(rest) / k)] for j in range(k))
+    return "\n".join(kept)
+
+def split_comments(comments):
+    """get_video_comments 的輸出拆回一則一則 (非留言的狀態字串如「無留言」回傳 [])"""
+    if not comments: return []
+    return [e for e in _COMMENT_ENTRY.split(comments) if e.lstrip("↳ ").startswith("👤 ")]
+
+def trim_comments(comments, max_tokens, min_entries=0):
+    """留言已依按讚數排序，以整則為單位由上往下保留到預算用完；前 min_entries 則無論預算都保留"""
+    if not comments or estimate_tokens(comments) <= max_tokens: return comments
+    kept, used = [], 0
+    for entry in _COMMENT_ENTRY.split(comments):
+        cost = estimate_tokens(entry) + 1
+        if used + cost > max_tokens and len(kept) >= min_entries: break
+        kept.append(entry)
+        used += cost
+    return "\n".join(kept)
+
+def _item_floor(item):
+    """每支影片的最低保留量：前 MIN_COMMENTS 則留言 + 開頭字幕"""
+    comments = trim_comments(item.get("comments"), 0, min_entries=MIN_COMMENTS)
+    return estimate_tokens(comments or "") + min(estimate_tokens(item.get("transcript") or ""), MIN_TRANSCRIPT_TOKENS)
+
+def fit_items_to_budget(items, total_budget, fixed_tokens=0):
+    """items: [{"transcript", "comments", ...}]，就地裁切；fixed_tokens 為指令與媒體等無法裁切的部分。
+    每支影片至少保留開頭字幕與前幾則熱門留言；連這些都放不下時 infeasible 為 True，實際輸入會超出預算。
+    回傳 {"budget", "before", "after", "trimmed", "infeasible"} 供 UI 顯示"""
+    def cost(item): return estimate_tokens(item.get("transcript") or "") + estimate_tokens(item.get("comments") or "")
+    before = fixed_tokens + sum(cost(it) for it in items)
+    trimmed, infeasible = 0, False
+    if before > total_budget:
+        needs = [cost(it) for it in items]
+        floors = [min(need, _item_floor(it)) for it, need in zip(items, needs)]
+        available = total_budget - fixed_tokens
+        infeasible = available < sum(floors)
+        extra = allocate_budget([need - floor for need, floor in zip(needs, floors)], available - sum(floors))
+        for item, need, floor, more in zip(items, needs, floors, extra):
+            quota = floor + more
+            if need <= quota: continue
+            trimmed += 1
+            c_need = estimate_tokens(item.get("comments") or "")
+            t_need = estimate_tokens(item.get("transcript") or "")
+            c_quota = min(c_need, max(int(quota * COMMENT_SHARE), quota - t_need))
+            item["comments"] = trim_comments(item.get("comments"), c_quota, min_entries=MIN_COMMENTS)
+            t_floor = min(t_need, MIN_TRANSCRIPT_TOKENS)
+            item["transcript"] = trim_transcript(item.get("transcript"), max(t_floor, quota - estimate_tokens(item["comments"] or "")))
+    after = fixed_tokens + sum(cost(it) for it in items)
+    return {"budget": total_budget, "before": before, "after": after, "trimmed": trimmed, "infeasible": infeasible}
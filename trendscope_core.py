@@ -0,0 +1,893 @@
+"""TrendScope 分析核心：素材抓取、Gemini 上傳與報告生成。
+
+不依賴 Streamlit，供 UI (YT調查.py) 與批次執行器 (trendscope_batch.py) 共用。
+進度與提示一律透過 callback / 回傳的 messages 交給呼叫端顯示。
+"""
+import os
+import re
+import time
+import random
+import heapq
+import hashlib
+import json
+import sqlite3
+import threading
+from functools import lru_cache
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from trendscope_lazy import LazyModule
+from trendscope_quota import scheduler, parse_retry_after, TASK_PRIORITIES, PRIORITY_ANALYSIS, PRIORITY_BATCH
+from trendscope_media import prepare_media, needs_processing, media_opts_key, ytdlp_audio_format, ytdlp_video_format
+from trendscope_workspace import RunWorkspace, WorkspaceQuotaExceeded, DEFAULT_QUOTA_BYTES, AUDIO_RESERVE_BYTES, VIDEO_RESERVE_BYTES
+from trendscope_budget import FALLBACK_BUDGET, default_budget, estimate_contents, estimate_tokens, fit_items_to_budget, media_tokens, split_comments
+from trendscope_images import DEFAULT_MAX_EDGE, DEFAULT_QUALITY, preprocess_images
+from trendscope_models import AUTO_MODEL, model_stats, rank_models
+from trendscope_trace import span, spanned, current_span, traced
+from trendscope_reports import split_deep_dive, renumber_section, section_reusable, section_matches_title
+
+# 重量級套件延遲到第一次使用才載入 (UI 冷啟動 / 每次重跑都不必等)
+genai = LazyModule("google.generativeai")
+yt_dlp = LazyModule("yt_dlp")
+youtube_transcript_api = LazyModule("youtube_transcript_api")
+
+DEFAULT_MODEL = "models/gemini-1.5-flash"
+
+class RetryExhausted(Exception):
+    pass
+
+# --- 智慧 API 呼叫 ---
+def smart_api_call(func, *args, on_wait=None, model_name=None, priority=PRIORITY_ANALYSIS, est_tokens=1, max_retries=3, **kwargs):
+    """指定 model_name 時先經共用限流器排隊；429/503 時優先依伺服器 retry-after 退避，
+    並讓同模型的其他請求一起暫停，而不是各自重試"""
+    base_wait = 5
+    for attempt in range(max_retries):
+        if model_name: current_span().add("queued_s", scheduler.acquire(model_name, est_tokens, priority))
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if "429" in str(e) or "503" in str(e):
+                wait_time = parse_retry_after(e) or base_wait * (2 ** attempt)
+                if on_wait: on_wait(wait_time)
+                current_span().add("retries", 1)
+                current_span().add("backoff_s", wait_time)
+                if model_name: scheduler.throttled(model_name, wait_time)
+                else: time.sleep(wait_time)
+            else:
+                raise e
+    raise RetryExhausted("API 重試失敗")
+
+# --- 模型排序 ---
+def sort_models_by_version(models):
+    def score_model(name):
+        score = 0
+        if "gemini-1.5-flash" in name: score += 10000
+        elif "gemini-2.0" in name: score += 5000
+        elif "gemini-1.5-pro" in name: score += 1000
+        return score
+    valid_models = [m for m in models if "gemini" in m]
+    return sorted(valid_models, key=score_model, reverse=True)
+
+# --- Word 導出 ---
+@spanned("docx.build")
+def create_word_docx(text, title="分析報告"):
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    doc = Document()
+    doc.add_heading(f'TrendScope {title}', 0).alignment = WD_ALIGN_PARAGRAPH.CENTER
+    doc.add_paragraph(f"生成時間: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line: continue
+        if line.startswith('# '): doc.add_heading(line.replace('# ', ''), 1)
+        elif line.startswith('## '): doc.add_heading(line.replace('## ', ''), 2)
+        elif line.startswith('### '): doc.add_heading(line.replace('### ', ''), 3)
+        elif line.startswith('- '): doc.add_paragraph(line.replace('- ', ''), style='List Bullet')
+        else: doc.add_paragraph(line)
+    buffer = BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+# --- 本機快取 (SQLite，依影片 ID 存放 Metadata / 留言 / 字幕) ---
+CACHE_DB_PATH = "trendscope_cache.db"
+CACHE_TTLS = {"info": 6 * 3600, "comments": 2 * 3600, "transcript": 7 * 86400, "gemini_file": 47 * 3600, "models": 12 * 3600}
+CACHE_MAX_ENTRIES = 3000
+INFO_KEYS = ('id', 'title', 'channel', 'uploader', 'upload_date', 'duration', 'view_count', 'like_count', 'comment_count', 'description', 'webpage_url')
+
+class DiskCache:
+    """依 (kind, key) 存放 JSON 值；各類別有獨立 TTL，超過上限時依最後存取時間 (LRU) 淘汰"""
+    def __init__(self, path, ttls=None, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttls = ttls or CACHE_TTLS
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+                kind TEXT, key TEXT, value TEXT, created REAL, accessed REAL,
+                PRIMARY KEY (kind, key))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, kind, key):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value, created FROM cache WHERE kind=? AND key=?", (kind, key)).fetchone()
+            if not row: return None
+            if now - row[1] > self.ttls.get(kind, 3600):
+                conn.execute("DELETE FROM cache WHERE kind=? AND key=?", (kind, key))
+                return None
+            conn.execute("UPDATE cache SET accessed=? WHERE kind=? AND key=?", (now, kind, key))
+        return json.loads(row[0])
+
+    def set(self, kind, key, value):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)", (kind, key, json.dumps(value, ensure_ascii=False), now, now))
+            count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute("DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY accessed LIMIT ?)", (count - self.max_entries,))
+
+    def delete(self, kind, key):
+        with self._lock, self._connect() as conn: conn.execute("DELETE FROM cache WHERE kind=? AND key=?", (kind, key))
+
+    def clear(self):
+        with self._lock, self._connect() as conn: conn.execute("DELETE FROM cache")
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            return dict(conn.execute("SELECT kind, COUNT(*) FROM cache GROUP BY kind").fetchall())
+
+@lru_cache(maxsize=None)
+def get_disk_cache(path=CACHE_DB_PATH):
+    # 同一行程內共用 (Streamlit 各 session / 批次各 worker)
+    return DiskCache(path)
+
+# --- 工具函數 ---
+def format_timestamp(seconds):
+    return str(timedelta(seconds=int(seconds)))
+
+def calculate_days_ago(upload_date_str):
+    try:
+        if not upload_date_str: return "未知"
+        upload_dt = datetime.strptime(upload_date_str, "%Y%m%d")
+        now = datetime.now()
+        diff = now - upload_dt
+        days = diff.days
+        if days < 0: return "未來"
+        if days == 0: return "今天"
+        return f"{days} 天前"
+    except: return upload_date_str
+
+# --- Gemini 上傳登錄表 (內容雜湊 / 來源網址 → 遠端檔名，避免重複上傳) ---
+def content_sha256(source):
+    """source 可為檔案路徑或 bytes / memoryview"""
+    if not isinstance(source, str): return hashlib.sha256(source).hexdigest()
+    h = hashlib.sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    return h.hexdigest()
+
+def registry_namespace(api_key):
+    # 遠端檔案僅屬於上傳時的 API Key 專案
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16] if api_key else ""
+
+def find_live_gemini_file(reg_key):
+    disk_cache = get_disk_cache()
+    entry = disk_cache.get("gemini_file", reg_key)
+    if not entry: return None
+    if entry.get("expires", 0) < time.time() + 600:
+        disk_cache.delete("gemini_file", reg_key)
+        return None
+    try:
+        file = genai.get_file(entry["name"])
+        if file.state.name == "ACTIVE": return file
+    except: pass
+    disk_cache.delete("gemini_file", reg_key)
+    return None
+
+def register_gemini_file(reg_keys, file):
+    exp = getattr(file, "expiration_time", None)
+    expires = exp.timestamp() if exp else time.time() + 47 * 3600
+    for k in reg_keys:
+        if k: get_disk_cache().set("gemini_file", k, {"name": file.name, "expires": expires})
+
+@spanned("gemini.upload")
+def upload_to_gemini(source, mime_type=None, registry_ns="", source_key=None):
+    """只負責上傳、不等待處理完成；回傳 (file, reg_keys)，file 可能仍為 PROCESSING，交由 wait_for_gemini_files 等待。
+    source 為檔案路徑，或記憶體中的 bytes / memoryview (此時須指定 mime_type，直接上傳不落地)"""
+    if not mime_type and isinstance(source, str):
+        if source.endswith('.mp4'): mime_type = 'video/mp4'
+        elif source.endswith('.mp3'): mime_type = 'audio/mp3'
+        elif source.endswith('.m4a'): mime_type = 'audio/mp4'
+        elif source.endswith('.ogg'): mime_type = 'audio/ogg'
+        elif source.endswith('.webm'): mime_type = 'audio/webm'
+    content_key = f"{registry_ns}:sha256:{content_sha256(source)}:{mime_type}"
+    file = find_live_gemini_file(content_key)
+    current_span().set(mime=mime_type or "", reused=bool(file))
+    if file:
+        register_gemini_file([source_key], file)
+        return file, []
+    payload = source if isinstance(source, str) else BytesIO(source)
+    current_span().set(bytes=os.path.getsize(source) if isinstance(source, str) else len(source))
+    return genai.upload_file(payload, mime_type=mime_type), [content_key, source_key]
+
+# 處理狀態輪詢：指數退避的起點 / 上限與抖動範圍 (基準測試會縮放並關閉抖動)
+GEMINI_POLL_BASE_DELAY = 1.0
+GEMINI_POLL_MAX_DELAY = 16.0
+GEMINI_POLL_JITTER = (0.5, 1.0)
+
+def wait_for_gemini_files(pending, timeout=300, base_delay=None, max_delay=None):
+    """pending: {key: (file, reg_keys)}。以指數退避 + 抖動輪詢，依就緒先後 yield (key, file, error)；
+    失敗或逾時時 file 為 None、error 為原因說明。base_delay / max_delay 未指定時用 GEMINI_POLL_*"""
+    base_delay = GEMINI_POLL_BASE_DELAY if base_delay is None else base_delay
+    max_delay = GEMINI_POLL_MAX_DELAY if max_delay is None else max_delay
+    deadline = time.time() + timeout
+    state = {k: {"file": f, "reg_keys": rk, "attempt": 0, "next": 0.0} for k, (f, rk) in pending.items()}
+    while state:
+        now = time.time()
+        for key in [k for k, s in state.items() if s["next"] <= now]:
+            s = state[key]
+            if s["attempt"] > 0:
+                try: s["file"] = genai.get_file(s["file"].name)
+                except Exception as e:
+                    if now >= deadline:
+                        del state[key]
+                        yield key, None, f"查詢狀態失敗: {e}"
+                        continue
+            file_state = s["file"].state.name
+            if file_state == "ACTIVE":
+                register_gemini_file(s["reg_keys"], s["file"])
+                del state[key]
+                yield key, s["file"], None
+            elif file_state == "PROCESSING" and now < deadline:
+                s["next"] = now + min(max_delay, base_delay * (2 ** s["attempt"])) * random.uniform(*GEMINI_POLL_JITTER)
+                s["attempt"] += 1
+            elif file_state == "PROCESSING":
+                del state[key]
+                yield key, None, f"處理逾時 (>{timeout} 秒)"
+            else:
+                del state[key]
+                yield key, None, f"處理失敗 ({file_state})"
+        if state: time.sleep(max(0.05, min(s["next"] for s in state.values()) - time.time()))
+
+# --- YouTube / TikTok 素材抓取 ---
+def extract_video_id(url):
+    vid_match = re.search(r'(?:v=|\/)([0-9A-Za-z_-]{11})', url)
+    return vid_match.group(1) if vid_match else None
+
+def cache_key(url):
+    return extract_video_id(url) or url.strip()
+
+@spanned("yt.transcript")
+def get_yt_transcript(video_id, use_cache=True):
+    disk_cache = get_disk_cache()
+    if use_cache:
+        cached = disk_cache.get("transcript", video_id)
+        if cached is not None:
+            current_span().set(cached=True)
+            return cached
+    try:
+        t = youtube_transcript_api.YouTubeTranscriptApi.get_transcript(video_id, languages=['zh-TW', 'zh', 'en'])
+        transcript = "\n".join([f"[{format_timestamp(x['start'])}] {x['text']}" for x in t])
+        current_span().set(lines=len(t), chars=len(transcript))
+        disk_cache.set("transcript", video_id, transcript)
+        return transcript
+    except: return None
+
+@spanned("yt.info")
+def get_yt_info(url, use_cache=True):
+    disk_cache = get_disk_cache()
+    key = cache_key(url)
+    if use_cache:
+        cached = disk_cache.get("info", key)
+        if cached is not None:
+            current_span().set(cached=True)
+            return cached
+    ydl_opts = {'quiet': True, 'noplaylist': True, 'extract_flat': True}
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            if info: disk_cache.set("info", key, {k: info.get(k) for k in INFO_KEYS})
+            return info
+    except: return None
+
+COMMENT_FETCH_LIMIT = 200
+COMMENT_FETCH_MAX = 2000  # 硬上限：留言全部留在記憶體裡排序，不允許「全部抓回」
+COMMENT_TIMEOUT = 60
+COMMENT_SOCKET_TIMEOUT = 20
+COMMENT_MAX_CHARS = 300
+
+class _CommentsCancelled(Exception):
+    pass
+
+def _comment_ydl_opts(fetch_limit, include_replies):
+    ydl_opts = {'quiet': True, 'noplaylist': True, 'extract_flat': False, 'getcomments': True, 'skip_download': True, 'socket_timeout': COMMENT_SOCKET_TIMEOUT}
+    # max_comments = 總數,頂層數,回覆總數,每串回覆數；comment_sort=top 讓 YouTube 先回熱門留言
+    replies, per_thread = (str(fetch_limit), '3') if include_replies else ('0', '0')
+    ydl_opts['extractor_args'] = {'youtube': {'comment_sort': ['top'], 'max_comments': [str(fetch_limit), str(fetch_limit), replies, per_thread]}}
+    return ydl_opts
+
+def _cancel_requests_on(ydl, event):
+    """event 設定後，yt_dlp 的下一個網路請求直接失敗，擷取隨之中止 (不會在背景繼續翻頁)"""
+    urlopen = getattr(ydl, "urlopen", None)
+    if urlopen is None: return
+    def guarded(req):
+        if event.is_set(): raise _CommentsCancelled("留言擷取已逾時")
+        return urlopen(req)
+    ydl.urlopen = guarded
+
+@spanned("yt.comments")
+def get_video_comments(url, max_comments=30, use_cache=True, fetch_limit=COMMENT_FETCH_LIMIT, include_replies=False, timeout=COMMENT_TIMEOUT):
+    """只抓熱門前 fetch_limit 則 (上限 COMMENT_FETCH_MAX；0 視為上限)，再取按讚數前 max_comments 則。
+    timeout 秒內沒抓完就放棄該支影片的留言並中止擷取：進行中的請求最多再等 COMMENT_SOCKET_TIMEOUT 秒，之後不再發出新請求"""
+    fetch_limit = min(fetch_limit or COMMENT_FETCH_MAX, COMMENT_FETCH_MAX)
+    disk_cache = get_disk_cache()
+    key = f"{cache_key(url)}:{max_comments}:{fetch_limit}:{int(include_replies)}"
+    if use_cache:
+        cached = disk_cache.get("comments", key)
+        if cached is not None:
+            current_span().set(cached=True)
+            return cached
+    ydl_opts = _comment_ydl_opts(fetch_limit, include_replies)
+    box, cancel = {}, threading.Event()
+    def _extract():
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                _cancel_requests_on(ydl, cancel)
+                box["comments"] = ydl.extract_info(url, download=False).get('comments') or []
+        except Exception as e: box["error"] = e
+    worker = threading.Thread(target=_extract, daemon=True)
+    worker.start()
+    worker.join(timeout or None)
+    if worker.is_alive():
+        cancel.set()
+        current_span().set(timed_out=True)
+        return "留言讀取逾時"
+    if "error" in box: return "留言讀取受限"
+    if not box["comments"]: return "無留言"
+    current_span().set(fetched=len(box["comments"]))
+    top = heapq.nlargest(max_comments, (c for c in box["comments"] if c.get('text')), key=lambda c: c.get('like_count') or 0)
+    comments_text = []
+    for c in top:
+        prefix = "↳ " if c.get('parent', 'root') != 'root' else ""
+        comments_text.append(f"{prefix}👤 {c.get('author', 'User')}: {c['text'][:COMMENT_MAX_CHARS]}")
+    result = "\n".join(comments_text)
+    disk_cache.set("comments", key, result)
+    return result
+
+@spanned("yt.download_audio")
+def download_yt_audio(url, out_base, format_spec='bestaudio[ext=m4a]/bestaudio', max_filesize=None):
+    """out_base 為不含副檔名的輸出路徑 (位於本次的 RunWorkspace)"""
+    ydl_opts = {'format': format_spec, 'outtmpl': out_base + '.%(ext)s', 'quiet': True, 'ignoreerrors': True}
+    if max_filesize is not None: ydl_opts['max_filesize'] = max_filesize
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl: ydl.download([url])
+        for ext in ['m4a', 'webm', 'mp3']:
+            if os.path.exists(f"{out_base}.{ext}"):
+                current_span().set(bytes=os.path.getsize(f"{out_base}.{ext}"))
+                return f"{out_base}.{ext}"
+        return None
+    except: return None
+
+@spanned("tiktok.download")
+def download_tiktok_video(url, out_path, format_spec='best[ext=mp4]/best', max_filesize=None):
+    ydl_opts = {
+        'outtmpl': out_path, 'format': format_spec, 'quiet': True, 'ignoreerrors': True,
+        'http_headers': {'User-Agent': 'Mozilla/5.0 (Linux; Android 10; K)', 'Referer': 'https://www.tiktok.com/'}
+    }
+    if max_filesize is not None: ydl_opts['max_filesize'] = max_filesize
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl: ydl.download([url])
+        if os.path.exists(out_path):
+            current_span().set(bytes=os.path.getsize(out_path))
+            return out_path
+        return None
+    except: return None
+
+# --- 單支 YT 素材抓取 (於背景執行緒執行) ---
+@spanned("yt.ingest")
+def ingest_yt_video(url, idx, token_saver, use_cache=True, registry_ns="", comment_opts=None, media_opts=None, workspace=None):
+    item = {"title": "Unknown", "duration": None, "comments": "", "transcript": None, "g_file": None, "pending": None, "error": None, "video_id": cache_key(url), "audio_key": None}
+    current_span().set(video=idx + 1)
+    info = get_yt_info(url, use_cache=use_cache)
+    if info:
+        item["title"] = info.get('title') or "Unknown"
+        item["duration"] = info.get('duration')
+    item["comments"] = get_video_comments(url, use_cache=use_cache, **(comment_opts or {}))
+    if "v=" in url or "youtu.be" in url:
+        vid = extract_video_id(url)
+        if vid: item["transcript"] = get_yt_transcript(vid, use_cache=use_cache)
+    if not (item["transcript"] and token_saver):
+        if media_opts and media_opts.get("duration"):
+            item["duration"] = min(item["duration"] or media_opts["duration"], media_opts["duration"])
+        item["audio_key"] = f"{cache_key(url)}:audio:{media_opts_key(media_opts)}"
+        source_key = f"{registry_ns}:src:{item['audio_key']}"
+        item["g_file"] = find_live_gemini_file(source_key)
+        if not item["g_file"]:
+            aud_path = None
+            try:
+                with workspace.reserve(AUDIO_RESERVE_BYTES) as limit:
+                    aud_path = download_yt_audio(url, workspace.path_for(f"yt_audio_{idx}"), format_spec=ytdlp_audio_format(media_opts), max_filesize=limit)
+            except WorkspaceQuotaExceeded as e: item["error"] = f"音訊未下載: {e}"
+            if aud_path:
+                try:
+                    with span("media.prepare", kind="audio"): up_path, mime = prepare_media(aud_path, "audio", media_opts, out_dir=workspace.path)
+                    workspace.check_quota()
+                    item["pending"] = upload_to_gemini(up_path, mime_type=mime, registry_ns=registry_ns, source_key=source_key)
+                except Exception as e: item["error"] = f"音訊上傳失敗: {e}"
+    return item
+
+def ingest_yt_batch(urls, token_saver, max_workers=4, on_done=None, use_cache=True, registry_ns="", comment_opts=None, media_opts=None, workspace=None):
+    """並行抓取多支影片，結果依原始順序回傳；on_done(idx, done, total) 於呼叫端執行緒回報進度"""
+    results = [None] * len(urls)
+    if not urls: return results
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as pool:
+        futures = {pool.submit(traced(ingest_yt_video), url, i, token_saver, use_cache, registry_ns, comment_opts, media_opts, workspace): i for i, url in enumerate(urls)}
+        for done, fut in enumerate(as_completed(futures), 1):
+            i = futures[fut]
+            try: results[i] = fut.result()
+            except Exception: results[i] = None
+            if on_done: on_done(i, done, len(urls))
+    return results
+
+# --- 生成 (可串流) ---
+def generate_text(model, contents, task="analysis", stream=True, on_chunk=None, on_wait=None, priority=None, max_retries=3):
+    """串流時每收到一段就以目前全文呼叫 on_chunk；串流中途被切斷 (429/503) 會由 smart_api_call 整段重來。
+    priority 未指定時依 task 決定 (chat 優先於分析)。回傳 (完整文字, 延遲紀錄)，紀錄含首 token 時間 (TTFT) 與模型名稱；
+    每次呼叫的結果都計入 model_stats 供 auto 路由參考"""
+    model_name = getattr(model, "model_name", None)
+    def _call():
+        start = time.time()
+        if not stream:
+            text = model.generate_content(contents).text
+            elapsed = time.time() - start
+            return text, {"task": task, "model": model_name, "stream": False, "ttft": elapsed, "total": elapsed, "chars": len(text)}
+        ttft, parts = None, []
+        for chunk in model.generate_content(contents, stream=True):
+            try: piece = chunk.text
+            except ValueError: continue
+            if ttft is None: ttft = time.time() - start
+            parts.append(piece)
+            if on_chunk: on_chunk("".join(parts))
+        text = "".join(parts)
+        return text, {"task": task, "model": model_name, "stream": True, "ttft": ttft if ttft is not None else time.time() - start, "total": time.time() - start, "chars": len(text)}
+    def _run():
+        try: text, latency = _call()
+        except Exception as e:
+            if model_name: model_stats.record_error(model_name, throttled=("429" in str(e) or "503" in str(e)))
+            raise
+        if model_name: model_stats.record_success(model_name, latency)
+        return text, latency
+    if priority is None: priority = TASK_PRIORITIES.get(task, PRIORITY_ANALYSIS)
+    est_tokens = estimate_contents(contents)
+    with span("gemini.generate", task=task, model=model_name or "", stream=stream, tokens_in=est_tokens) as sp:
+        text, latency = smart_api_call(_run, on_wait=on_wait, model_name=model_name, priority=priority, est_tokens=est_tokens, max_retries=max_retries)
+        sp.set(tokens_out=estimate_tokens(text), ttft=latency["ttft"])
+    return text, latency
+
+# === 安全模型初始化 ===
+_configured_key = None
+_configure_lock = threading.Lock()
+
+def configure_client(api_key):
+    """genai.configure 是行程層級的設定：一個行程同一時間只服務一把 API Key。
+    每次取用模型前都要呼叫 (同一把 Key 時不重做)，確保請求用的是目前呼叫端的 Key；
+    不同 Key 的使用者同時操作時，後設定的 Key 會蓋過先前的，需要多把 Key 請各自開行程"""
+    global _configured_key
+    with _configure_lock:
+        if api_key != _configured_key:
+            genai.configure(api_key=api_key)
+            _configured_key = api_key
+
+def get_model_with_fallback(model_name, use_search=False, on_fallback=None):
+    if not use_search: return genai.GenerativeModel(model_name)
+    try:
+        return genai.GenerativeModel(model_name, tools=[{'google_search': {}}])
+    except:
+        if on_fallback: on_fallback()
+        return genai.GenerativeModel(model_name)
+
+# === 模型目錄與自動路由 ===
+MAX_FAILOVER = 3
+
+def get_model_catalogue(registry_ns="", use_cache=True):
+    """可用於 generateContent 的 Gemini 模型 [{"name", "input_token_limit", "output_token_limit"}]；
+    依 API key 命名空間存在本機快取，各 session / 批次共用，不必每次連線都 list_models"""
+    cache = get_disk_cache()
+    if use_cache:
+        hit = cache.get("models", registry_ns)
+        if hit: return hit
+    catalogue = [
+        {"name": m.name, "input_token_limit": getattr(m, "input_token_limit", None), "output_token_limit": getattr(m, "output_token_limit", None)}
+        for m in genai.list_models() if 'generateContent' in m.supported_generation_methods and "gemini" in m.name
+    ]
+    if catalogue: cache.set("models", registry_ns, catalogue)
+    return catalogue
+
+def resolve_models(model_name, task="analysis", catalogue=None, est_tokens=0):
+    """回傳依序嘗試的模型名稱；非 auto 時就是指定的模型"""
+    if model_name != AUTO_MODEL: return [model_name]
+    return rank_models(catalogue or [], task, est_tokens, blocked_for=scheduler.blocked_for)[:MAX_FAILOVER] or [DEFAULT_MODEL]
+
+def generate_routed(model_name, contents, task="analysis", catalogue=None, use_search=False, on_fallback=None, stream=True, on_chunk=None, on_wait=None, priority=None, model_factory=None):
+    """auto 時依序嘗試 resolve_models 的候選：某模型被限流 (429/503) 就立刻換下一個，只有最後一個會完整重試。
+    model_factory 與 get_model_with_fallback 同介面，UI 用它換成快取過的模型物件"""
+    model_factory = model_factory or get_model_with_fallback
+    candidates = resolve_models(model_name, task, catalogue, estimate_contents(contents))
+    for n, name in enumerate(candidates):
+        last = n == len(candidates) - 1
+        model = model_factory(name, use_search=use_search, on_fallback=on_fallback)
+        try:
+            return generate_text(model, contents, task=task, stream=stream, on_chunk=on_chunk, on_wait=on_wait, priority=priority, max_retries=3 if last else 1)
+        except RetryExhausted:
+            if last: raise
+
+# === 追問用 Context Cache ===
+CONTEXT_CACHE_MIN_TOKENS = 32_768  # Gemini cached content 的最小輸入量，低於此值直接走一般模式
+CONTEXT_CACHE_TTL_MINUTES = 60
+SEARCH_INSTRUCTION = "若使用者詢問人物身分或地點，請務必使用 Google Search 查詢並提供 Wiki 或新聞連結。"
+
+def build_followup_contents(gemini_files, images, report):
+    """追問 / 腳本共用的素材：所有媒體檔、社群圖片與報告全文"""
+    contents = []
+    for i, f in enumerate(gemini_files):
+        contents.append(f"【媒體 #{i+1}】")
+        contents.append(f)
+    for i, img in enumerate(images):
+        contents.append(f"【圖片 #{i+1}】")
+        contents.append(img)
+    contents.append(f"【報告】\n{report}")
+    return contents
+
+@spanned("gemini.context_cache")
+def create_context_cache(model_name, contents, use_search=True, ttl_minutes=CONTEXT_CACHE_TTL_MINUTES):
+    """把追問素材建成 cached content；模型不支援 / 素材太小 / 建立失敗時回傳 None，呼叫端照舊每次重送"""
+    if estimate_contents(contents) < CONTEXT_CACHE_MIN_TOKENS: return None
+    from google.generativeai import caching
+    kwargs = dict(model=model_name, display_name="trendscope-followup", contents=contents, ttl=timedelta(minutes=ttl_minutes))
+    for tools in ([{'google_search': {}}], None) if use_search else (None,):
+        try: return caching.CachedContent.create(tools=tools, **kwargs) if tools else caching.CachedContent.create(**kwargs)
+        except Exception: continue
+    return None
+
+def drop_context_cache(cached):
+    if not cached: return
+    try: cached.delete()
+    except Exception: pass
+
+_CACHE_GONE_MARKERS = ("notfound", "not found", "404", "permissiondenied", "permission", "403", "expired")
+
+def context_cache_gone(e):
+    """快取已過期 / 被刪除 / 無權限時為 True；限流 (429 / RetryExhausted) 等其他錯誤不算，不該因此改為重送全部素材"""
+    if isinstance(e, RetryExhausted): return False
+    text = f"{type(e).__name__} {e}".lower()
+    return any(m in text for m in _CACHE_GONE_MARKERS)
+
+def get_cached_model(cached):
+    return genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+# ================= 分析指令 =================
+YT_DEEP_PROMPT = """
+**⚠️ 首席流量分析師指令 (SYSTEM OVERRIDE):**
+你現在是 YouTube 演算法與內容策略專家。請針對上述素材進行「深度拆解」。
+我們不要淺層摘要，我們要的是「為什麼會紅」的底層邏輯。
+
+請產出【TrendScope 深度結構報告】：
+
+========================================
+PART 1: 🔬 個別深度診斷 (Deep Dive)
+========================================
+(請針對每一支影片，結合 Metadata、字幕內容與網友留言進行分析)
+**📍 影片 #N - [標題]**
+- **內容核心與鉤子 (Hook)**: 前 15 秒到底做了什麼留住觀眾？(請引用畫面或台詞)
+- **流量歸因**: 是標題黨？還是內容乾貨？還是情緒共鳴？
+- **🗣️ 輿情真實風向**: 網友留言都在討論什麼？(支持/反對/玩梗/抓錯)
+- **⏱️ 高光時刻 (Highlights)**: 請列出 2-3 個最精彩的時間點 [MM:SS] 及其內容。
+
+========================================
+PART 2: 🌪️ 流量密碼交叉比對 (Macro Analysis)
+========================================
+### 1. 📊 綜合比較矩陣
+| 影片標題 | 封面/選題策略 | 敘事節奏 | 觀眾情緒 | 爆紅指數 (1-5⭐) |
+
+### 2. 🧠 共同爆款公式
+*   **選題邏輯**: 這些影片切中了什麼共同的人性弱點或需求？
+*   **結構共性**: 它們是否都用了類似的開場或結尾？
+
+========================================
+PART 3: 💡 最佳執行建議 (Actionable Advice)
+========================================
+若我要製作一支超越這些競品的影片，我應該：
+1. (具體建議)
+2. (具體建議)
+"""
+
+TIKTOK_PROMPT = """
+**TikTok 視覺分析指令:**
+請「觀看」上述影片並進行歸納。**請根據內容自動擬定標題**。
+PART 1: 👁️ 視覺矩陣 (AI Title | Visual Hook | BGM | Viral Factor)
+PART 2: ⚡ 短影音流量公式 (前3秒重點 / 節奏 / 引導)
+"""
+
+SOCIAL_PROMPT = """
+**社群圖文分析:**
+請分析圖片的視覺重點與潛在情緒。
+**注意**：我已啟用 Google Search，若有必要請隨時查詢網路資訊。
+"""
+
+# 報告庫增量分析：只對新 / 變動的影片做 PART 1，再以全部 PART 1 重生 PART 2 / 3
+_YT_PART2_AT = YT_DEEP_PROMPT.index("========================================\nPART 2")
+# 存進報告庫的 PART 1 依編號對回影片，編號與標題都必須照素材
+YT_NUMBERING_NOTE = "\n(PART 1 的影片編號請沿用素材中的 YT #N (可能不連續)，[標題] 照抄素材標題)\n"
+YT_SECTION_PROMPT = YT_DEEP_PROMPT[:_YT_PART2_AT] + YT_NUMBERING_NOTE + "(本次只需產出上述影片的 PART 1；不要產出 PART 2 / PART 3)\n"
+YT_MACRO_PROMPT = """
+**⚠️ 首席流量分析師指令 (SYSTEM OVERRIDE):**
+上面是每支影片的 PART 1 個別深度診斷 (部分沿用先前的分析)。
+請只根據這些診斷產出【TrendScope 深度結構報告】的 PART 2 與 PART 3，格式如下：
+
+""" + YT_DEEP_PROMPT[_YT_PART2_AT:]
+YT_REPORT_HEAD = "【TrendScope 深度結構報告】\n\n========================================\nPART 1: 🔬 個別深度診斷 (Deep Dive)\n========================================\n\n"
+# 指令改版後舊的 PART 1 不再沿用
+YT_PROMPT_KEY = hashlib.sha256(YT_DEEP_PROMPT.encode()).hexdigest()[:12]
+
+def content_hash_for(item):
+    """影片本身的識別：標題 + 字幕 + 音訊設定。熱門留言變動太快，另以 comment_keys_for 比對"""
+    payload = [item["title"], item["transcript"], item["audio_key"]]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode()).hexdigest()[:16]
+
+def comment_keys_for(item):
+    return [hashlib.sha1(c.encode()).hexdigest()[:10] for c in split_comments(item["comments"])]
+
+# ================= 分析管線 =================
+def new_run_result(mode, prompt=""):
+    """管線輸出：data_inputs 送給模型，raw_context 為人可讀的素材摘要，messages 為 (level, text) 提示，
+    budget 為 token 預算裁切統計，videos 為 YT 各影片的 ID / 內容雜湊 / 對應的 data_inputs 片段 (報告庫沿用 PART 1 用)"""
+    return {"mode": mode, "prompt": prompt, "data_inputs": [], "raw_context": [], "gemini_files": [], "images": [], "messages": [], "budget": None, "videos": []}
+
+@spanned("pipeline.youtube")
+def run_youtube_pipeline(urls, token_saver=True, max_workers=4, use_cache=True, registry_ns="", progress=None, token_budget=FALLBACK_BUDGET, comment_opts=None, media_opts=None, workspace_quota=DEFAULT_QUOTA_BYTES):
+    """comment_opts 轉交 get_video_comments (max_comments / fetch_limit / include_replies / timeout)；
+    media_opts 為音訊前處理設定 (trendscope_media.AUDIO_PROFILES 的 profile / start / duration)；
+    下載與轉檔都寫在本次專用的 RunWorkspace，結束後整個目錄於背景刪除"""
+    progress = progress or (lambda label: None)
+    result = new_run_result("youtube", YT_DEEP_PROMPT)
+    data_inputs, raw_context_builder = result["data_inputs"], result["raw_context"]
+    urls = [u for u in urls if u.strip()]
+    with RunWorkspace(workspace_quota) as workspace:
+        progress(f"🔴 並行抓取 {len(urls)} 支 YT 素材...")
+        results = ingest_yt_batch(
+            urls, token_saver, max_workers=max_workers, use_cache=use_cache, registry_ns=registry_ns, comment_opts=comment_opts, media_opts=media_opts,
+            workspace=workspace, on_done=lambda i, done, n: progress(f"🔴 YT #{i+1} 素材完成 ({done}/{n})")
+        )
+    # 上傳已完成，等待 Gemini 處理時本機檔案已可刪除
+    pending = {i: item["pending"] for i, item in enumerate(results) if item and item["pending"]}
+    if pending: progress(f"⏳ 等待 {len(pending)} 個音訊檔處理...")
+    with span("gemini.processing", files=len(pending)):
+        for i, g_file, err in wait_for_gemini_files(pending):
+            if g_file: results[i]["g_file"] = g_file
+            else: results[i]["error"] = f"音訊{err}"
+
+    # 內容雜湊取裁切前的素材：同一支影片的 PART 1 診斷只有在素材變動時才需要重做
+    items = [item for item in results if item]
+    for item in items: item["content_hash"], item["comment_keys"] = content_hash_for(item), comment_keys_for(item)
+
+    # 依預算裁切字幕 / 留言 (指令與音訊為固定成本)
+    fixed = estimate_tokens(YT_DEEP_PROMPT) + sum(
+        estimate_tokens(item["title"]) + 30 + (media_tokens("audio/", item["duration"]) if item["g_file"] else 0) for item in items
+    )
+    result["budget"] = fit_items_to_budget(items, token_budget, fixed_tokens=fixed)
+    if result["budget"]["trimmed"]:
+        progress(f"✂️ 已依預算裁切 {result['budget']['trimmed']} 支影片的字幕 / 留言")
+    if result["budget"]["infeasible"]:
+        result["messages"].append(("warning", f"⚠️ 指令與音訊已約 {fixed:,} tokens，加上每支影片最低保留的開頭字幕與熱門留言仍超過預算 {token_budget:,}；"
+                                              f"實際輸入約 {result['budget']['after']:,} tokens，可減少影片數、縮短音訊片段或提高預算"))
+
+    for i, item in enumerate(results):
+        if not item:
+            result["messages"].append(("warning", f"⚠️ YT #{i+1} 素材抓取失敗，已略過。"))
+            continue
+        first_part = len(data_inputs)
+        meta_str = f"\n=== YT #{i+1}: {item['title']} ===\n"
+        data_inputs.append(meta_str)
+        raw_context_builder.append(meta_str)
+
+        comments = item["comments"]
+        data_inputs.append(f"【YT #{i+1} 留言輿情】\n{comments}")
+        raw_context_builder.append(f"留言摘要:\n{comments[:500]}...\n")
+
+        transcript = item["transcript"]
+        if transcript:
+            trans_str = f"【YT #{i+1} 字幕內容(含時間碼)】:\n{transcript}"
+            data_inputs.append(trans_str)
+            raw_context_builder.append(trans_str + "\n")
+
+        if item["error"]: result["messages"].append(("warning", f"⚠️ YT #{i+1} {item['error']}"))
+        g_file = item["g_file"]
+        if g_file:
+            data_inputs.append(g_file)
+            result["gemini_files"].append(g_file)
+            raw_context_builder.append(f"[音訊掛載: {g_file.name}]")
+        result["videos"].append({"index": i + 1, "video_id": item["video_id"], "content_hash": item["content_hash"], "comment_keys": item["comment_keys"], "title": item["title"], "parts": data_inputs[first_part:]})
+    return result
+
+@spanned("pipeline.tiktok")
+def run_tiktok_pipeline(sources, registry_ns="", progress=None, media_opts=None, workspace_quota=DEFAULT_QUOTA_BYTES):
+    """sources: [('url', 連結) | ('file', 具 getbuffer() 的上傳物件或 bytes) | ('path', 本機 mp4 路徑)]；
+    media_opts 為影片前處理設定 (trendscope_media.VIDEO_PROFILES 的 profile / start / duration)。
+    不需轉檔的上傳檔直接從記憶體送到 Gemini，其餘寫到本次的 RunWorkspace"""
+    progress = progress or (lambda label: None)
+    result = new_run_result("tiktok", TIKTOK_PROMPT)
+    total = len(sources)
+    ready, pending = {}, {}
+    with RunWorkspace(workspace_quota) as workspace:
+        for i, (src_type, src_content) in enumerate(sources):
+            progress(f"🔵 準備 TikTok #{i+1}...")
+            video_src = None
+            g_file = None
+            source_key = None
+            try:
+                if src_type == 'url':
+                    source_key = f"{registry_ns}:src:{src_content.strip()}:mp4:{media_opts_key(media_opts)}"
+                    g_file = find_live_gemini_file(source_key)
+                    if not g_file:
+                        with workspace.reserve(VIDEO_RESERVE_BYTES) as limit:
+                            video_src = download_tiktok_video(src_content, workspace.path_for(f"tt_video_{i}.mp4"), format_spec=ytdlp_video_format(media_opts), max_filesize=limit)
+                        if not video_src:
+                            result["messages"].append(("error", f"❌ #{i+1} 下載失敗，請改用上傳。"))
+                            continue
+                elif src_type == 'file':
+                    buf = src_content.getbuffer() if hasattr(src_content, "getbuffer") else src_content
+                    source_key = f"{registry_ns}:upload:{hashlib.sha256(buf).hexdigest()}:{media_opts_key(media_opts)}"
+                    g_file = find_live_gemini_file(source_key)
+                    if not g_file:
+                        if needs_processing(media_opts):
+                            video_src = workspace.path_for(f"upload_{i}.mp4")
+                            with open(video_src, "wb") as f: f.write(buf)
+                        else:
+                            video_src = buf  # 直接從記憶體上傳
+                elif src_type == 'path':
+                    video_src = src_content
+
+                if g_file: ready[i] = g_file
+                elif video_src is not None:
+                    if isinstance(video_src, str) and needs_processing(media_opts):
+                        progress(f"🎞️ 前處理 TikTok #{i+1}...")
+                        with span("media.prepare", kind="video"): video_src, _ = prepare_media(video_src, "video", media_opts, out_dir=workspace.path)
+                        workspace.check_quota()
+                    progress(f"👁️ 上傳影片 #{i+1}...")
+                    pending[i] = upload_to_gemini(video_src, mime_type='video/mp4', registry_ns=registry_ns, source_key=source_key)
+            except Exception as e: result["messages"].append(("error", f"❌ #{i+1} 上傳失敗: {e}"))
+
+    if pending: progress(f"⏳ 等待 {len(pending)} 支影片處理...")
+    with span("gemini.processing", files=len(pending)):
+        for i, g_file, err in wait_for_gemini_files(pending):
+            if g_file:
+                ready[i] = g_file
+                progress(f"✅ TikTok #{i+1} 就緒 ({len(ready)}/{total})")
+            else: result["messages"].append(("error", f"❌ #{i+1} 影片{err}"))
+
+    for i in sorted(ready):
+        g_file = ready[i]
+        result["data_inputs"].append(f"【TikTok #{i+1}】(請觀看影片自訂標題)")
+        result["data_inputs"].append(g_file)
+        result["gemini_files"].append(g_file)
+        result["raw_context"].append(f"\n=== TikTok #{i+1} ===\n[影片掛載: {g_file.name}]")
+    return result
+
+@spanned("pipeline.social")
+def run_social_pipeline(images, note="", image_opts=None, max_workers=4):
+    """images: 上傳物件、本機路徑或 bytes；image_opts: {"max_edge", "format", "quality", "dedupe"}。
+    圖片先縮圖 / 重新編碼，result["images"] 只保存 {"mime_type", "data"} blob"""
+    opts, images = image_opts or {}, list(images)
+    result = new_run_result("social", SOCIAL_PROMPT)
+    if note: result["data_inputs"].append(f"補充: {note}")
+    try:
+        with span("images.preprocess", images=len(images)) as sp:
+            blobs, kept, n_dup = preprocess_images(
+                images, max_edge=opts.get("max_edge", DEFAULT_MAX_EDGE), fmt=opts.get("format", "WEBP"),
+                quality=opts.get("quality", DEFAULT_QUALITY), dedupe=opts.get("dedupe", True), max_workers=max_workers,
+            )
+            sp.set(kept=len(blobs), bytes=sum(len(b["data"]) for b in blobs))
+    except (OSError, ValueError) as e:
+        result["messages"].append(("error", f"❌ 圖片讀取失敗: {e}"))
+        return result
+    if n_dup: result["messages"].append(("info", f"🧹 略過 {n_dup} 張重複截圖"))
+    for i, blob in zip(kept, blobs):
+        result["data_inputs"].append(f"\n=== 圖片 #{i+1} ===\n")
+        result["data_inputs"].append(blob)
+        result["images"].append(blob)
+    return result
+
+def generate_report(model_name, result, catalogue=None, on_fallback=None, stream=True, on_chunk=None, on_wait=None, priority=None, model_factory=None, store=None):
+    """TikTok 走 vision 任務、其他走 analysis；社群模式開啟 Google Search。
+    YT 模式傳入 store (trendscope_reports.ReportStore) 時走增量分析，沿用統計寫在 result["reuse"]"""
+    kwargs = dict(catalogue=catalogue, on_fallback=on_fallback, stream=stream, on_wait=on_wait, priority=priority, model_factory=model_factory)
+    if store is not None and result["mode"] == "youtube" and result["videos"]:
+        return _generate_youtube_incremental(model_name, result, store, on_chunk, kwargs)
+    return generate_routed(
+        model_name, result["data_inputs"] + [result["prompt"]], task="vision" if result["mode"] == "tiktok" else "analysis",
+        use_search=(result["mode"] == "social"), on_chunk=on_chunk, **kwargs,
+    )
+
+def _reuse_plan(result, store):
+    """→ (可沿用的 {(video_id, content_hash): PART 1}, 需要重做的影片)"""
+    videos = result["videos"]
+    comment_keys = {(v["video_id"], v["content_hash"]): v["comment_keys"] for v in videos}
+    # 影片本身沒變、但熱門留言已大幅換血且診斷已過時的，也當成新影片重做
+    stored = {k: row["section"] for k, row in store.find_sections(list(comment_keys), YT_PROMPT_KEY).items() if section_reusable(row, comment_keys[k])}
+    return stored, [v for v in videos if (v["video_id"], v["content_hash"]) not in stored]
+
+def report_contents(result, store=None):
+    """generate_report 會送出的輸入，供送出前估算 token。沿用 PART 1 時為新影片素材 + 沿用的診斷 + 兩段指令
+    (不含新影片 PART 1 的輸出再送進 PART 2 / 3 的部分)；回傳 (contents, 沿用支數)"""
+    if store is None or result["mode"] != "youtube" or not result["videos"]:
+        return result["data_inputs"] + [result["prompt"]], 0
+    stored, fresh = _reuse_plan(result, store)
+    if not stored: return result["data_inputs"] + [result["prompt"] + YT_NUMBERING_NOTE], 0
+    contents = [p for v in fresh for p in v["parts"]] + ([YT_SECTION_PROMPT] if fresh else [])
+    return contents + list(stored.values()) + [YT_MACRO_PROMPT], len(stored)
+
+def _generate_youtube_incremental(model_name, result, store, on_chunk, kwargs):
+    videos = result["videos"]
+    stored, fresh = _reuse_plan(result, store)
+    result["reuse"] = {"reused": len(videos) - len(fresh), "new": len(fresh)}
+    if not stored:
+        # 全部都是新影片：照常一次產出完整報告，再把 PART 1 拆開存起來
+        report, latency = generate_routed(model_name, result["data_inputs"] + [result["prompt"] + YT_NUMBERING_NOTE], task="analysis", on_chunk=on_chunk, **kwargs)
+        _store_sections(store, videos, split_deep_dive(report), latency)
+        return report, latency
+
+    fresh_idx = {v["index"] for v in fresh}
+    sections = {v["index"]: renumber_section(stored[(v["video_id"], v["content_hash"])], v["index"]) for v in videos if v["index"] not in fresh_idx}
+    total = 0.0
+    if fresh:
+        inputs = [p for v in fresh for p in v["parts"]] + [YT_SECTION_PROMPT]
+        text, latency = generate_routed(model_name, inputs, task="analysis", on_chunk=on_chunk, **kwargs)
+        total += latency["total"]
+        parsed = split_deep_dive(YT_REPORT_HEAD + text)
+        _store_sections(store, fresh, parsed, latency)
+        for v in fresh: sections[v["index"]] = parsed.get(v["index"], "")
+        if not any(parsed.get(v["index"]) for v in fresh): sections[fresh[0]["index"]] = text.strip()  # 格式不符時整段保留
+
+    part1 = "\n\n".join(sections[v["index"]] for v in videos if sections.get(v["index"]))
+    head = YT_REPORT_HEAD + part1 + "\n\n"
+    macro_chunk = (lambda t: on_chunk(head + t)) if on_chunk else None
+    text, latency = generate_routed(model_name, [f"【PART 1 個別深度診斷】\n{part1}", YT_MACRO_PROMPT], task="analysis", on_chunk=macro_chunk, **kwargs)
+    latency["total"] += total
+    return head + text, latency
+
+def run_inputs(result):
+    """存進報告庫的輸入摘要 (不含素材本身)"""
+    return [{"video_id": v["video_id"], "content_hash": v["content_hash"], "title": v["title"]} for v in result["videos"]]
+
+def _store_sections(store, videos, parsed, latency):
+    # 標題對不上代表模型的編號錯位，寧可不存也不要把別支影片的診斷綁到這個 video_id
+    entries = [(v["video_id"], v["content_hash"], parsed.get(v["index"]), v["comment_keys"]) for v in videos
+               if parsed.get(v["index"]) and section_matches_title(parsed[v["index"]], v["title"])]
+    current_span().set(sections_saved=len(entries), sections_skipped=len(videos) - len(entries))
+    store.save_sections(entries, YT_PROMPT_KEY, model=latency.get("model") or "")
+
+def run_analysis(mode, sources, model_name=DEFAULT_MODEL, note="", token_saver=True, max_workers=4, use_cache=True, registry_ns="", progress=None, stream=False, token_budget=None, comment_opts=None, media_opts=None, store=None):
+    """不經 UI 的完整分析 (批次用)；呼叫前須先 genai.configure。model_name 可為 AUTO_MODEL。
+    傳入 store 時沿用 / 保存 YT 的 PART 1，並把本次紀錄存進報告庫 (result["run_id"])。回傳管線結果並附上 report / latency"""
+    catalogue = get_model_catalogue(registry_ns, use_cache=use_cache) if model_name == AUTO_MODEL else None
+    if mode == "youtube":
+        result = run_youtube_pipeline(
+            sources, token_saver=token_saver, max_workers=max_workers, use_cache=use_cache, registry_ns=registry_ns,
+            progress=progress, token_budget=token_budget or default_budget(resolve_models(model_name, "analysis", catalogue)[0]), comment_opts=comment_opts, media_opts=media_opts,
+        )
+    elif mode == "tiktok":
+        result = run_tiktok_pipeline(sources, registry_ns=registry_ns, progress=progress, media_opts=media_opts)
+    elif mode == "social":
+        result = run_social_pipeline(sources, note=note, max_workers=max_workers)
+    else:
+        raise ValueError(f"未知模式: {mode}")
+    result["report"], result["latency"] = "", None
+    if result["data_inputs"]:
+        result["report"], result["latency"] = generate_report(model_name, result, catalogue=catalogue, stream=stream, priority=PRIORITY_BATCH, store=store)
+        if store is not None:
+            result["run_id"] = store.save_run(mode, result["latency"].get("model") or model_name, run_inputs(result), "\n".join(result["raw_context"]), result["report"], title=note or None)
+    return result
@@ -0,0 +1,109 @@
+"""探索模式：給頻道 / 播放清單 / 搜尋關鍵字，串流讀取平面清單 (extract_flat，不逐支完整解析)，
+依觀看速度 (觀看數 / 上傳天數) 以固定大小的 heap 挑出前 K 名，只把勝出的影片送進 YT 深度分析。
+"""
+import heapq
+import re
+import time
+from datetime import datetime
+from itertools import islice
+from trendscope_lazy import LazyModule
+from trendscope_trace import spanned, current_span
+
+yt_dlp = LazyModule("yt_dlp")
+
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 10  # 與 YT 分頁手動輸入的上限一致
+DEFAULT_SCAN_LIMIT = 500
+MAX_SCAN_LIMIT = 5000
+RANK_MODES = {"velocity": "觀看速度 (觀看數 / 天)", "recent": "最新上傳", "views": "總觀看數"}
+
+_CHANNEL_URL = re.compile(r"^https?://(?:www\.|m\.)?youtube\.com/(?:@[^/?#]+|channel/[^/?#]+|c/[^/?#]+|user/[^/?#]+)/?$")
+
+def discovery_source(query, rank_by="velocity", scan_limit=DEFAULT_SCAN_LIMIT):
+    """頻道網址 / @handle → 影片分頁；播放清單等其他網址原樣使用；其餘視為搜尋關鍵字"""
+    query = query.strip()
+    if query.startswith("@"): return f"https://www.youtube.com/{query}/videos"
+    if re.match(r"^https?://", query):
+        return query.rstrip("/") + "/videos" if _CHANNEL_URL.match(query) else query
+    # 搜尋預設依相關度排序，找最新影片時改用依日期排序的搜尋
+    return f"ytsearch{'date' if rank_by == 'recent' else ''}{scan_limit}:{query}"
+
+def _walk_entries(entries):
+    for entry in entries or ():
+        if not entry: continue
+        if entry.get("_type") == "playlist":
+            yield from _walk_entries(entry.get("entries"))
+        elif entry.get("ie_key") in (None, "Youtube") and entry.get("id"):
+            yield entry
+
+def iter_flat_entries(source, limit=DEFAULT_SCAN_LIMIT):
+    """逐筆產生平面清單項目；process=False 讓 yt_dlp 邊翻頁邊回傳，不會先把整個清單讀進記憶體"""
+    ydl_opts = {
+        'quiet': True, 'extract_flat': 'in_playlist', 'lazy_playlist': True, 'skip_download': True, 'ignoreerrors': True,
+        # 平面清單預設沒有上傳日期；approximate_date 由「3 天前」這類文字換算出近似日期
+        'extractor_args': {'youtubetab': {'approximate_date': ['']}},
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(source, download=False, process=False)
+        if not info: return
+        entries = info.get("entries") if info.get("_type") == "playlist" else [info]
+        yield from islice(_walk_entries(entries), limit)
+
+def days_since(entry, now=None):
+    now = now or time.time()
+    ts = entry.get("timestamp") or entry.get("release_timestamp")
+    if not ts and entry.get("upload_date"):
+        try: ts = datetime.strptime(entry["upload_date"], "%Y%m%d").timestamp()
+        except ValueError: return None
+    return max(0.0, (now - ts) / 86400) if ts else None
+
+def rank_score(entry, rank_by="velocity", now=None):
+    """分數越大越前面；缺少排名所需欄位時回傳 None (不列入排名)"""
+    if entry.get("live_status") in ("is_live", "is_upcoming"): return None
+    views, days = entry.get("view_count"), days_since(entry, now)
+    if rank_by == "views": return views
+    if days is None: return None
+    if rank_by == "recent": return (-days, views or 0)
+    if views is None: return None
+    return views / max(days, 1.0)
+
+def top_k(entries, k, key):
+    """固定大小的 min-heap：記憶體只保留 k 筆，數千筆候選也只需掃過一次；回傳 (前 k 名, 無法排名的筆數)"""
+    heap, seen, skipped = [], set(), 0
+    for n, entry in enumerate(entries):
+        if entry["id"] in seen: continue
+        seen.add(entry["id"])
+        score = key(entry)
+        if score is None:
+            skipped += 1
+            continue
+        item = (score, -n, entry)  # 同分時保留較早出現的
+        if len(heap) < k: heapq.heappush(heap, item)
+        elif item > heap[0]: heapq.heapreplace(heap, item)
+    return [entry for _, _, entry in sorted(heap, reverse=True)], skipped
+
+@spanned("discovery")
+def discover_videos(query, k=DEFAULT_TOP_K, rank_by="velocity", scan_limit=DEFAULT_SCAN_LIMIT, now=None):
+    """回傳 {"source", "videos": [{url, title, channel, view_count, days, velocity}], "scanned", "skipped"}"""
+    if rank_by not in RANK_MODES: raise ValueError(f"未知排序: {rank_by}")
+    now = now or time.time()
+    k, scan_limit = max(1, min(k, MAX_TOP_K)), max(1, min(scan_limit, MAX_SCAN_LIMIT))
+    source = discovery_source(query, rank_by, scan_limit)
+    scanned = 0
+    def counted(entries):
+        nonlocal scanned
+        for entry in entries:
+            scanned += 1
+            yield entry
+    winners, skipped = top_k(counted(iter_flat_entries(source, scan_limit)), k, lambda e: rank_score(e, rank_by, now))
+    videos = []
+    for e in winners:
+        days = days_since(e, now)
+        videos.append({
+            "url": f"https://www.youtube.com/watch?v={e['id']}", "title": e.get("title") or e["id"],
+            "channel": e.get("channel") or e.get("uploader") or "", "view_count": e.get("view_count"),
+            "days": None if days is None else round(days, 1),
+            "velocity": None if days is None or e.get("view_count") is None else round(e["view_count"] / max(days, 1.0)),
+        })
+    current_span().set(source=source, scanned=scanned, skipped=skipped, kept=len(videos))
+    return {"source": source, "videos": videos, "scanned": scanned, "skipped": skipped}
@@ -0,0 +1,61 @@
+"""社群截圖前處理：縮圖、去除 EXIF、重新編碼成 WebP / JPEG，並以感知雜湊 (dHash) 去除重複截圖。
+
+輸出為 {"mime_type", "data"} 的 blob，可直接放進 generate_content，也是 session 內唯一保存的形式。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from trendscope_lazy import LazyModule
+
+Image = LazyModule("PIL.Image")
+ImageOps = LazyModule("PIL.ImageOps")
+
+# Gemini 會把圖片切成 768px 的區塊計價，超過 ~1536px 對截圖辨識幫助不大
+DEFAULT_MAX_EDGE = 1536
+MODEL_MAX_EDGES = [("flash-8b", 1024)]
+IMAGE_FORMATS = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+DEFAULT_QUALITY = 80
+DEDUPE_DISTANCE = 5  # dHash 漢明距離 ≤ 此值視為同一張
+
+def max_edge_for_model(model_name):
+    for keyword, edge in MODEL_MAX_EDGES:
+        if keyword in model_name: return edge
+    return DEFAULT_MAX_EDGE
+
+def dhash(img, size=8):
+    gray = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    px = list(gray.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            bits = (bits << 1) | (px[row * (size + 1) + col] > px[row * (size + 1) + col + 1])
+    return bits
+
+def _read_bytes(src):
+    if isinstance(src, (bytes, bytearray)): return bytes(src)
+    if hasattr(src, "getvalue"): return src.getvalue()
+    with open(src, "rb") as f: return f.read()
+
+def preprocess_image(src, max_edge=DEFAULT_MAX_EDGE, fmt="WEBP", quality=DEFAULT_QUALITY):
+    """回傳 (blob, dhash)；重新編碼時不帶 EXIF，方向先依 EXIF 轉正"""
+    with Image.open(BytesIO(_read_bytes(src))) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"): img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA", "L"): img = img.convert("RGBA")
+        out = BytesIO()
+        img.save(out, format=fmt, quality=quality)
+        return {"mime_type": IMAGE_FORMATS[fmt], "data": out.getvalue()}, dhash(img)
+
+def preprocess_images(sources, max_edge=DEFAULT_MAX_EDGE, fmt="WEBP", quality=DEFAULT_QUALITY, dedupe=True, max_workers=4):
+    """並行處理，依原順序回傳 (blobs, 來源索引, 重複張數)；重複的以先出現者為準"""
+    if not sources: return [], [], 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sources)))) as pool:
+        processed = list(pool.map(lambda s: preprocess_image(s, max_edge, fmt, quality), sources))
+    blobs, kept_idx, kept_hashes = [], [], []
+    for i, (blob, h) in enumerate(processed):
+        if dedupe and any(bin(h ^ k).count("1") <= DEDUPE_DISTANCE for k in kept_hashes): continue
+        blobs.append(blob)
+        kept_idx.append(i)
+        kept_hashes.append(h)
+    return blobs, kept_idx, len(sources) - len(blobs)
@@ -0,0 +1,14 @@
+"""延遲載入：google.generativeai / yt_dlp / docx / PIL 等重量級套件在第一次用到時才 import，
+讓 Streamlit 首次繪製頁面與每次重跑不必等這些套件載入。"""
+import importlib
+
+class LazyModule:
+    """genai = LazyModule("google.generativeai")；第一次取屬性時才真正 import (之後由 sys.modules 快取)"""
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
@@ -0,0 +1,106 @@
+"""上傳前的媒體前處理 (ffmpeg)：音訊轉低位元率單聲道、影片降解析度 / 幀率、只切出指定時間窗。
+
+ffmpeg 由 packages.txt 安裝；找不到 ffmpeg 或轉檔失敗時一律回傳原檔，不影響分析流程。
+"""
+import os
+import shutil
+import subprocess
+
+FFMPEG_TIMEOUT = 300
+
+# 音訊 (YT 無字幕時上傳的音軌)
+AUDIO_PROFILES = {
+    "original": None,
+    "opus16k": {"codec": "libopus", "bitrate": "24k", "ext": "ogg", "mime": "audio/ogg"},
+    "mp3_16k": {"codec": "libmp3lame", "bitrate": "32k", "ext": "mp3", "mime": "audio/mp3"},
+}
+# 影片 (TikTok / Shorts)
+VIDEO_PROFILES = {
+    "original": None,
+    "720p15": {"max_height": 720, "fps": 15, "crf": 28},
+    "480p12": {"max_height": 480, "fps": 12, "crf": 30},
+}
+PROFILE_LABELS = {
+    "original": "原始檔 (不轉檔)",
+    "opus16k": "Opus 16kHz 單聲道 24kbps",
+    "mp3_16k": "MP3 16kHz 單聲道 32kbps",
+    "720p15": "720p / 15fps",
+    "480p12": "480p / 12fps",
+}
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+def _window_args(start, duration):
+    # -ss 放在 -i 前做快速定位；-t 放在 -i 後限制輸出長度
+    before = ["-ss", str(start)] if start else []
+    after = ["-t", str(duration)] if duration else []
+    return before, after
+
+def _run_ffmpeg(args, out_path):
+    try:
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error"] + args + [out_path], check=True, timeout=FFMPEG_TIMEOUT, capture_output=True)
+        return os.path.exists(out_path) and os.path.getsize(out_path) > 0
+    except (OSError, subprocess.SubprocessError):
+        if os.path.exists(out_path): os.remove(out_path)
+        return False
+
+def _out_path(path, ext, out_dir):
+    base = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(out_dir or os.path.dirname(path), f"{base}_prep.{ext}")
+
+def prepare_audio(path, profile="opus16k", start=0, duration=0, sample_rate=16000, out_dir=None):
+    """回傳 (路徑, mime)；失敗時 mime 為 None 表示沿用原檔"""
+    spec = AUDIO_PROFILES.get(profile)
+    if not spec and not (start or duration): return path, None
+    spec = spec or {"codec": "libopus", "bitrate": "48k", "ext": "ogg", "mime": "audio/ogg"}
+    out_path = _out_path(path, spec["ext"], out_dir)
+    before, after = _window_args(start, duration)
+    args = before + ["-i", path] + after + ["-vn", "-ac", "1", "-ar", str(sample_rate), "-c:a", spec["codec"], "-b:a", spec["bitrate"]]
+    if _run_ffmpeg(args, out_path): return out_path, spec["mime"]
+    return path, None
+
+def prepare_video(path, profile="720p15", start=0, duration=0, out_dir=None):
+    spec = VIDEO_PROFILES.get(profile)
+    if not spec and not (start or duration): return path, None
+    out_path = _out_path(path, "mp4", out_dir)
+    before, after = _window_args(start, duration)
+    args = before + ["-i", path] + after
+    if spec:
+        args += [
+            "-vf", f"scale=-2:'min({spec['max_height']},ih)',fps={spec['fps']}",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", str(spec["crf"]),
+            "-c:a", "aac", "-b:a", "64k", "-ac", "1",
+        ]
+    else:
+        args += ["-c", "copy"]  # 只切時間窗，不重新編碼
+    args += ["-movflags", "+faststart"]
+    if _run_ffmpeg(args, out_path): return out_path, "video/mp4"
+    return path, None
+
+def needs_processing(opts):
+    opts = opts or {}
+    return ffmpeg_available() and (opts.get("profile", "original") != "original" or bool(opts.get("start") or opts.get("duration")))
+
+def prepare_media(path, kind, opts=None, out_dir=None):
+    """kind: "audio" | "video"；opts: {"profile", "start", "duration"}；輸出寫到 out_dir (預設與原檔同目錄)。
+    回傳 (路徑, mime)，未處理時 mime 為 None"""
+    opts = opts or {}
+    if not needs_processing(opts): return path, None
+    prepare = prepare_audio if kind == "audio" else prepare_video
+    return prepare(path, opts.get("profile", "original"), opts.get("start", 0), opts.get("duration", 0), out_dir=out_dir)
+
+def media_opts_key(opts):
+    """登錄表 / 快取鍵用：不同前處理設定的產物不可互相沿用"""
+    opts = opts or {}
+    return f"{opts.get('profile', 'original')}@{opts.get('start', 0)}+{opts.get('duration', 0)}"
+
+def ytdlp_audio_format(opts):
+    # 之後會轉成低位元率，下載時就不必抓最高音質
+    if (opts or {}).get("profile", "original") != "original": return 'bestaudio[abr<=96][ext=m4a]/bestaudio[abr<=96]/bestaudio[ext=m4a]/bestaudio'
+    return 'bestaudio[ext=m4a]/bestaudio'
+
+def ytdlp_video_format(opts):
+    spec = VIDEO_PROFILES.get((opts or {}).get("profile", "original"))
+    if spec: return f"best[ext=mp4][height<={spec['max_height']}]/best[ext=mp4]/best"
+    return 'best[ext=mp4]/best'
@@ -0,0 +1,79 @@
+"""模型路由：記錄每個模型實測的延遲 / 錯誤率 / 吞吐量，"auto" 引擎依任務挑目前最快且能勝任的模型。
+
+model_stats 在同一行程內共用 (Streamlit 各 session、批次各 worker)，與 trendscope_quota.scheduler 相同。
+模型目錄 (list_models 的結果) 由 trendscope_core.get_model_catalogue 存在本機快取。
+"""
+import threading
+
+AUTO_MODEL = "auto"
+STATS_ALPHA = 0.3  # 延遲 / 吞吐量的指數移動平均權重
+ERROR_PENALTY = 2.0  # 錯誤率 10% → 預期延遲 × 1.2
+
+# 各任務的最低輸出長度；輸入上限另依實際素材量比對
+TASK_MIN_OUTPUT = {"analysis": 8192, "vision": 8192, "script": 4096, "chat": 2048}
+# 非一般文字生成用途的模型，不參與自動路由
+EXCLUDED_KEYWORDS = ("embedding", "aqa", "tts", "image-generation", "native-audio", "live")
+# 尚無實測資料時的預估延遲 (秒)，依模型名稱關鍵字比對
+LATENCY_PRIORS = [("flash-8b", 4.0), ("flash-lite", 4.0), ("flash", 6.0), ("pro", 20.0)]
+FALLBACK_LATENCY = 10.0
+
+def prior_latency(model_name):
+    for keyword, seconds in LATENCY_PRIORS:
+        if keyword in model_name: return seconds
+    return FALLBACK_LATENCY
+
+class ModelStats:
+    def __init__(self, alpha=STATS_ALPHA):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _entry(self, model_name):
+        return self._models.setdefault(model_name, {"calls": 0, "errors": 0, "throttled": 0, "latency": None, "ttft": None, "chars_per_s": None, "tasks": {}})
+
+    def _ewma(self, old, new):
+        return new if old is None else old + self.alpha * (new - old)
+
+    def record_success(self, model_name, latency):
+        """latency: generate_text 回傳的延遲紀錄 {"task", "ttft", "total", "chars"}"""
+        with self._lock:
+            e = self._entry(model_name)
+            e["calls"] += 1
+            e["latency"] = self._ewma(e["latency"], latency["total"])
+            e["ttft"] = self._ewma(e["ttft"], latency["ttft"])
+            if latency["total"] > 0 and latency["chars"]: e["chars_per_s"] = self._ewma(e["chars_per_s"], latency["chars"] / latency["total"])
+            e["tasks"][latency["task"]] = self._ewma(e["tasks"].get(latency["task"]), latency["total"])
+
+    def record_error(self, model_name, throttled=False):
+        with self._lock:
+            e = self._entry(model_name)
+            e["calls"] += 1
+            e["errors"] += 1
+            if throttled: e["throttled"] += 1
+
+    def expected_latency(self, model_name, task):
+        """同任務的實測值 > 該模型所有任務的實測值 > 名稱預估；再依錯誤率加權"""
+        with self._lock:
+            e = self._models.get(model_name)
+            if not e: return prior_latency(model_name)
+            seconds = e["tasks"].get(task) or e["latency"] or prior_latency(model_name)
+            return seconds * (1 + ERROR_PENALTY * e["errors"] / e["calls"])
+
+    def snapshot(self):
+        with self._lock:
+            return {m: dict(e, tasks=dict(e["tasks"]), error_rate=e["errors"] / e["calls"] if e["calls"] else 0.0) for m, e in self._models.items()}
+
+model_stats = ModelStats()
+
+def can_handle(model, task, est_tokens=0):
+    """model: 目錄項目 {"name", "input_token_limit", "output_token_limit"}"""
+    if any(k in model["name"] for k in EXCLUDED_KEYWORDS): return False
+    if model.get("input_token_limit") and est_tokens > model["input_token_limit"]: return False
+    if model.get("output_token_limit") and model["output_token_limit"] < TASK_MIN_OUTPUT.get(task, 0): return False
+    return True
+
+def rank_models(catalogue, task, est_tokens=0, blocked_for=None, stats=model_stats):
+    """能勝任的模型依預期延遲排序；blocked_for(model) > 0 (正在限流退避) 的排到最後"""
+    names = [m["name"] for m in catalogue if can_handle(m, task, est_tokens)]
+    def key(name): return (bool(blocked_for and blocked_for(name) > 0), stats.expected_latency(name, task))
+    return sorted(names, key=key)
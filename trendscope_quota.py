@@ -0,0 +1,141 @@
+"""Gemini 用戶端限流：每個模型一組 RPM / TPM 令牌桶 + 優先權佇列。
+
+模組層級的 scheduler 在同一行程內共用 (Streamlit 各 session、批次各 worker)，
+因此多人同時使用時會一起排隊，而不是各自撞上 429。
+"""
+import heapq
+import itertools
+import re
+import threading
+import time
+
+# 優先權：數字越小越先服務
+PRIORITY_CHAT = 0
+PRIORITY_SCRIPT = 1
+PRIORITY_ANALYSIS = 5
+PRIORITY_BATCH = 10
+TASK_PRIORITIES = {"chat": PRIORITY_CHAT, "script": PRIORITY_SCRIPT, "analysis": PRIORITY_ANALYSIS, "vision": PRIORITY_ANALYSIS}
+
+# (RPM, TPM) 預設值，依模型名稱關鍵字比對；實際額度可在側邊欄覆寫
+DEFAULT_QUOTAS = [
+    ("flash-8b", (15, 1_000_000)),
+    ("flash", (15, 1_000_000)),
+    ("pro", (2, 32_000)),
+]
+FALLBACK_QUOTA = (10, 250_000)
+
+def default_quota(model_name):
+    for keyword, quota in DEFAULT_QUOTAS:
+        if keyword in model_name: return quota
+    return FALLBACK_QUOTA
+
+def parse_retry_after(error):
+    """從錯誤訊息取出伺服器建議的等待秒數 (retry_delay / Retry-After / "retry in Ns")，沒有則回傳 None"""
+    text = str(error)
+    for pattern in (r"retry_delay\s*\{\s*seconds:\s*([\d.]+)", r"[Rr]etry-[Aa]fter:?\s*([\d.]+)", r"retry in ([\d.]+)\s*s"):
+        m = re.search(pattern, text)
+        if m: return float(m.group(1))
+    return None
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """距離可取出 amount 還要等幾秒 (0 表示現在就可以)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+class QuotaScheduler:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._limits = {}
+        self._queues = {}
+        self._blocked_until = {}
+        self._stats = {}
+
+    def configure(self, model_name, rpm=None, tpm=None):
+        """設定 (或重設) 模型額度；未指定者沿用預設值"""
+        d_rpm, d_tpm = default_quota(model_name)
+        rpm, tpm = rpm or d_rpm, tpm or d_tpm
+        with self._cond:
+            current = self._limits.get(model_name)
+            if current and (current["rpm"].capacity, current["tpm"].capacity) == (rpm, tpm): return
+            self._limits[model_name] = {"rpm": TokenBucket(rpm), "tpm": TokenBucket(tpm)}
+            self._cond.notify_all()
+
+    def limits(self, model_name):
+        with self._cond:
+            if model_name not in self._limits: return default_quota(model_name)
+            lim = self._limits[model_name]
+            return int(lim["rpm"].capacity), int(lim["tpm"].capacity)
+
+    def _stat(self, model_name):
+        return self._stats.setdefault(model_name, {"requests": 0, "queued_s": 0.0, "throttled": 0, "backoff_s": 0.0})
+
+    def acquire(self, model_name, tokens=1, priority=PRIORITY_ANALYSIS):
+        """阻塞直到輪到此請求且額度足夠；同模型的等待者依 (priority, 先來後到) 服務。回傳排隊秒數"""
+        start = time.monotonic()
+        with self._cond:
+            if model_name not in self._limits:
+                d_rpm, d_tpm = default_quota(model_name)
+                self._limits[model_name] = {"rpm": TokenBucket(d_rpm), "tpm": TokenBucket(d_tpm)}
+            ticket = (priority, next(self._seq))
+            queue = self._queues.setdefault(model_name, [])
+            heapq.heappush(queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    lim = self._limits[model_name]
+                    if queue[0] == ticket:
+                        wait = max(self._blocked_until.get(model_name, 0) - now, lim["rpm"].wait_time(1, now), lim["tpm"].wait_time(tokens, now))
+                        if wait <= 0: break
+                    else:
+                        wait = None
+                    self._cond.wait(wait)
+                lim["rpm"].take(1)
+                lim["tpm"].take(tokens)
+                heapq.heappop(queue)
+            except BaseException:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+                raise
+            finally:
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            stat = self._stat(model_name)
+            stat["requests"] += 1
+            stat["queued_s"] += waited
+        return waited
+
+    def throttled(self, model_name, wait_s):
+        """收到 429/503 時呼叫：該模型所有等待者一起暫停 wait_s 秒 (優先採用伺服器的 retry-after)"""
+        with self._cond:
+            stat = self._stat(model_name)
+            stat["throttled"] += 1
+            stat["backoff_s"] += wait_s
+            self._blocked_until[model_name] = max(self._blocked_until.get(model_name, 0), time.monotonic() + wait_s)
+            self._cond.notify_all()
+
+    def blocked_for(self, model_name):
+        """該模型還要退避幾秒 (0 表示未被限流)"""
+        with self._cond:
+            return max(0.0, self._blocked_until.get(model_name, 0) - time.monotonic())
+
+    def stats(self):
+        with self._cond:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+scheduler = QuotaScheduler()
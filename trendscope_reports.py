@@ -0,0 +1,158 @@
+"""報告庫 (SQLite + FTS5)：保存每次分析的輸入、素材摘要、報告與腳本，可全文搜尋歷史紀錄；
+並以 (影片 ID, 內容雜湊, 指令版本) 保存 YT 報告 PART 1 的個別影片診斷，重疊的請求可直接沿用。
+內容雜湊只涵蓋影片本身 (標題 / 字幕 / 音訊)；熱門留言另存指紋，換血過多且診斷已過 SECTION_COMMENT_TTL 時才重做。
+"""
+import json
+import re
+from difflib import SequenceMatcher
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+REPORTS_DB_PATH = "trendscope_reports.db"
+SEARCH_LIMIT = 20
+MIN_FTS_QUERY = 3  # trigram 分詞至少要 3 個字元，更短的查詢改用 LIKE
+SECTION_COMMENT_TTL = 12 * 3600  # 這段時間內的診斷不論留言變化都沿用
+COMMENT_SIMILARITY = 0.5         # 超過 TTL 後，熱門留言重疊度 (Jaccard) 低於此值就重做
+
+_SECTION_HEAD = re.compile(r"(?m)^(?=[ \t>*#_-]*📍\s*影片\s*#\d+)")
+_SECTION_NUM = re.compile(r"(📍\s*影片\s*#)(\d+)")
+_SECTION_TITLE = re.compile(r"📍\s*影片\s*#\d+\s*[-–—:：]?\s*(.+)")
+TITLE_SIMILARITY = 0.6
+_PART_HEAD = re.compile(r"(?m)^.*PART\s*([123])\b.*$")
+
+def split_deep_dive(report):
+    """從完整報告切出 PART 1 的個別影片診斷 → {影片編號: 段落}；格式不符時回傳 {}"""
+    parts = list(_PART_HEAD.finditer(report))
+    start = next((m.end() for m in parts if m.group(1) == "1"), None)
+    if start is None: return {}
+    end = next((m.start() for m in parts if m.group(1) in ("2", "3") and m.start() > start), len(report))
+    sections = {}
+    for block in _SECTION_HEAD.split(report[start:end]):
+        m = _SECTION_NUM.search(block)
+        if m and block.strip(): sections[int(m.group(2))] = block.strip().rstrip("=").strip()
+    return sections
+
+def renumber_section(section, index):
+    return _SECTION_NUM.sub(lambda m: f"{m.group(1)}{index}", section, count=1)
+
+def _normalize_title(title):
+    return re.sub(r"[\W_]+", "", title.lower())
+
+def section_matches_title(section, title):
+    """段落標題與素材標題是否為同一支影片 (模型可能改寫標點 / 截短)；標題缺漏時無法確認，視為不符"""
+    m = _SECTION_TITLE.search(section)
+    got, want = _normalize_title(m.group(1)) if m else "", _normalize_title(title or "")
+    if not got or not want: return False
+    return got in want or want in got or SequenceMatcher(None, got, want).ratio() >= TITLE_SIMILARITY
+
+def section_reusable(row, comment_keys, now=None):
+    """row: find_sections 的結果；本次沒抓到留言時沿用 (沒有新資訊可比)"""
+    if (now or time.time()) - row["created"] < SECTION_COMMENT_TTL: return True
+    old, new = set(row["comment_keys"]), set(comment_keys)
+    if not new or not old: return True
+    return len(old & new) / len(old | new) >= COMMENT_SIMILARITY
+
+class ReportStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY, created REAL, mode TEXT, model TEXT, title TEXT,
+                    inputs TEXT, raw_context TEXT, report TEXT);
+                CREATE TABLE IF NOT EXISTS scripts (
+                    id INTEGER PRIMARY KEY, run_id INTEGER, created REAL, prompt TEXT, script TEXT);
+                CREATE TABLE IF NOT EXISTS sections (
+                    video_id TEXT, content_hash TEXT, prompt_key TEXT, model TEXT, section TEXT, created REAL, comment_keys TEXT,
+                    PRIMARY KEY (video_id, content_hash, prompt_key));
+                CREATE INDEX IF NOT EXISTS idx_scripts_run ON scripts(run_id);
+            """)
+            try: conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(kind UNINDEXED, run_id UNINDEXED, title, body, tokenize='trigram')")
+            except sqlite3.OperationalError:
+                # 舊版 SQLite 沒有 trigram：退回預設分詞 (中文只能整段比對)
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(kind UNINDEXED, run_id UNINDEXED, title, body)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    # --- 分析紀錄 ---
+    def save_run(self, mode, model, inputs, raw_context, report, title=None):
+        """inputs: [{"video_id", "content_hash", "title"}]；回傳 run_id"""
+        title = title or " / ".join(i.get("title") or i.get("video_id", "") for i in inputs)[:200] or mode
+        with self._lock, self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO runs (created, mode, model, title, inputs, raw_context, report) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), mode, model, title, json.dumps(inputs, ensure_ascii=False), raw_context, report))
+            run_id = cur.lastrowid
+            conn.execute("INSERT INTO search (kind, run_id, title, body) VALUES ('report', ?, ?, ?)", (run_id, title, report))
+        return run_id
+
+    def add_script(self, run_id, prompt, script):
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT INTO scripts (run_id, created, prompt, script) VALUES (?, ?, ?, ?)", (run_id, time.time(), prompt, script))
+            title = (conn.execute("SELECT title FROM runs WHERE id=?", (run_id,)).fetchone() or [""])[0]
+            conn.execute("INSERT INTO search (kind, run_id, title, body) VALUES ('script', ?, ?, ?)", (run_id, title, script))
+
+    def get_run(self, run_id):
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT id, created, mode, model, title, inputs, raw_context, report FROM runs WHERE id=?", (run_id,)).fetchone()
+            if not row: return None
+            scripts = [s[0] for s in conn.execute("SELECT script FROM scripts WHERE run_id=? ORDER BY id", (run_id,))]
+        keys = ("id", "created", "mode", "model", "title", "inputs", "raw_context", "report")
+        run = dict(zip(keys, row), scripts=scripts)
+        run["inputs"] = json.loads(run["inputs"] or "[]")
+        return run
+
+    def recent(self, limit=SEARCH_LIMIT):
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT id, created, mode, title FROM runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [{"id": r[0], "created": r[1], "mode": r[2], "title": r[3], "snippet": ""} for r in rows]
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """全文搜尋報告與腳本；同一筆分析只列一次 (取最相關的片段)"""
+        query = query.strip()
+        if not query: return self.recent(limit)
+        with self._lock, self._connect() as conn:
+            if len(query) >= MIN_FTS_QUERY:
+                phrase = '"' + query.replace('"', '""') + '"'
+                rows = conn.execute(
+                    "SELECT run_id, snippet(search, 3, '**', '**', '…', 16) FROM search WHERE search MATCH ? ORDER BY rank LIMIT ?",
+                    (phrase, limit * 3)).fetchall()
+            else:
+                like = f"%{query}%"
+                rows = conn.execute(
+                    "SELECT run_id, substr(body, max(1, instr(body, ?) - 30), 80) FROM search WHERE body LIKE ? OR title LIKE ? LIMIT ?",
+                    (query, like, like, limit * 3)).fetchall()
+            hits, seen = [], set()
+            for run_id, snippet in rows:
+                if run_id in seen: continue
+                seen.add(run_id)
+                meta = conn.execute("SELECT created, mode, title FROM runs WHERE id=?", (run_id,)).fetchone()
+                if meta: hits.append({"id": run_id, "created": meta[0], "mode": meta[1], "title": meta[2], "snippet": snippet})
+                if len(hits) >= limit: break
+        return hits
+
+    # --- 個別影片診斷 (PART 1) ---
+    def find_sections(self, keys, prompt_key):
+        """keys: [(video_id, content_hash)] → {(video_id, content_hash): {"section", "comment_keys", "created"}}"""
+        found = {}
+        with self._lock, self._connect() as conn:
+            for vid, h in keys:
+                row = conn.execute("SELECT section, comment_keys, created FROM sections WHERE video_id=? AND content_hash=? AND prompt_key=?", (vid, h, prompt_key)).fetchone()
+                if row: found[(vid, h)] = {"section": row[0], "comment_keys": json.loads(row[1] or "[]"), "created": row[2]}
+        return found
+
+    def save_sections(self, entries, prompt_key, model=""):
+        """entries: [(video_id, content_hash, 段落, 留言指紋)]"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sections (video_id, content_hash, prompt_key, model, section, created, comment_keys) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(vid, h, prompt_key, model, section, now, json.dumps(ckeys)) for vid, h, section, ckeys in entries if section])
+
+@lru_cache(maxsize=None)
+def get_report_store(path=REPORTS_DB_PATH):
+    return ReportStore(path)
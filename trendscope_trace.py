@@ -0,0 +1,139 @@
+"""輕量追蹤：以 span 記錄每個階段的耗時、位元組、token 與重試退避時間，可匯出 JSON / OTLP (OpenTelemetry) 格式。
+
+目前 span 存在 contextvar 裡；丟到執行緒池的工作要用 traced(fn) 包起來才會接在同一條 trace 下。
+沒有進行中的 trace 時 span() 是空操作，核心函式可以無條件加上 span。
+"""
+import contextvars
+import functools
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("trendscope_span", default=None)
+
+class Span:
+    def __init__(self, trace, name, parent_id, attrs):
+        self.trace, self.name, self.parent_id = trace, name, parent_id
+        self.span_id = secrets.token_hex(8)
+        self.attrs = dict(attrs)
+        self.start, self.end, self.error = time.time(), None, None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def record(self):
+        end = self.end or time.time()
+        return {
+            "trace_id": self.trace.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+            "start": self.start, "end": end, "duration_s": round(end - self.start, 4), "attrs": dict(self.attrs), "error": self.error,
+        }
+
+class _NoopSpan:
+    def set(self, **attrs): pass
+    def add(self, key, amount): pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self._lock = threading.Lock()
+        self._spans = []
+
+    def _append(self, span):
+        with self._lock: self._spans.append(span)
+
+    def records(self):
+        """依開始時間排序的 span 紀錄 (純 dict，可存入 session / 寫成 JSON)"""
+        with self._lock: spans = list(self._spans)
+        return sorted((s.record() for s in spans), key=lambda r: r["start"])
+
+@contextmanager
+def _enter(span):
+    token = _current.set(span)
+    try: yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end = time.time()
+        _current.reset(token)
+
+@contextmanager
+def start_trace(name, **attrs):
+    """with start_trace("youtube") as trace: ...；結束後以 trace.records() 取出結果"""
+    trace = Trace()
+    root = Span(trace, name, None, attrs)
+    trace._append(root)
+    with _enter(root): yield trace
+
+@contextmanager
+def span(name, **attrs):
+    parent = _current.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    s = Span(parent.trace, name, parent.span_id, attrs)
+    parent.trace._append(s)
+    with _enter(s): yield s
+
+def spanned(name):
+    """裝飾器：整個函式包在一個 span 裡；函式內以 current_span().set(...) 補上屬性"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name): return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+def traced(fn):
+    """在呼叫端複製目前的 context，讓 fn 在其他執行緒執行時仍掛在同一個父 span 下；每次提交都要重新包一次"""
+    ctx = contextvars.copy_context()
+    @functools.wraps(fn)
+    def run(*args, **kwargs): return ctx.run(fn, *args, **kwargs)
+    return run
+
+def timeline(records):
+    """UI / 文字報表用：[{"階段", "開始 (s)", "耗時 (s)", ...attrs}]，名稱依層級縮排"""
+    if not records: return []
+    by_id = {r["span_id"]: r for r in records}
+    t0 = min(r["start"] for r in records)
+    def depth(r):
+        d = 0
+        while r["parent_id"] in by_id: r, d = by_id[r["parent_id"]], d + 1
+        return d
+    rows = []
+    for r in records:
+        row = {"階段": "　" * depth(r) + r["name"], "開始 (s)": round(r["start"] - t0, 2), "耗時 (s)": round(r["duration_s"], 2)}
+        row.update({k: round(v, 2) if isinstance(v, float) else v for k, v in r["attrs"].items()})
+        if r["error"]: row["錯誤"] = r["error"]
+        rows.append(row)
+    return rows
+
+def _otlp_value(v):
+    if isinstance(v, bool): return {"boolValue": v}
+    if isinstance(v, int): return {"intValue": str(v)}
+    if isinstance(v, float): return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+def to_otlp(records, service_name="trendscope"):
+    """轉成 OTLP/JSON 的 resourceSpans 結構，可直接送到 OpenTelemetry Collector 的 /v1/traces"""
+    spans = []
+    for r in records:
+        spans.append({
+            "traceId": r["trace_id"], "spanId": r["span_id"], "parentSpanId": r["parent_id"] or "", "name": r["name"], "kind": 1,
+            "startTimeUnixNano": str(int(r["start"] * 1e9)), "endTimeUnixNano": str(int(r["end"] * 1e9)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in r["attrs"].items()],
+            "status": {"code": 2, "message": r["error"]} if r["error"] else {"code": 1},
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{"scope": {"name": "trendscope"}, "spans": spans}],
+    }]}
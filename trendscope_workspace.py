@@ -0,0 +1,106 @@
+"""每次分析專用的暫存目錄：優先放在 tmpfs (/dev/shm)，結束後於背景刪除，並有容量上限。
+
+目錄名稱帶有建立者的 PID；行程崩潰留下的目錄會在下次啟動時由 sweep_orphans 清掉。
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+WORKSPACE_PREFIX = "trendscope_run_"
+DEFAULT_QUOTA_BYTES = 2 * 1024 ** 3
+ORPHAN_MAX_AGE = 6 * 3600
+TMPFS_DIR = "/dev/shm"
+# 單次下載預留的上限 (也是 yt_dlp 的 max_filesize)；並行下載各自預留，不會每支都拿到整個剩餘配額
+AUDIO_RESERVE_BYTES = 256 * 1024 ** 2
+VIDEO_RESERVE_BYTES = 512 * 1024 ** 2
+
+class WorkspaceQuotaExceeded(Exception):
+    pass
+
+def workspace_root(quota_bytes=DEFAULT_QUOTA_BYTES):
+    """tmpfs 可寫且剩餘空間足以放下整個配額時用 tmpfs，否則用系統暫存目錄"""
+    try:
+        if os.access(TMPFS_DIR, os.W_OK) and shutil.disk_usage(TMPFS_DIR).free > quota_bytes: return TMPFS_DIR
+    except OSError: pass
+    return tempfile.gettempdir()
+
+def _pid_alive(pid):
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except OSError: return True  # 行程存在但無權限
+    return True
+
+def sweep_orphans(root=None, max_age=ORPHAN_MAX_AGE):
+    """刪除建立者已不存在、或超過 max_age 秒的暫存目錄；回傳刪除數量"""
+    removed = 0
+    for base in {root} if root else {TMPFS_DIR, tempfile.gettempdir()}:
+        try: names = os.listdir(base)
+        except OSError: continue
+        for name in names:
+            if not name.startswith(WORKSPACE_PREFIX): continue
+            path = os.path.join(base, name)
+            try:
+                pid = int(name[len(WORKSPACE_PREFIX):].split("_", 1)[0])
+                stale = not _pid_alive(pid) or time.time() - os.path.getmtime(path) > max_age
+            except (ValueError, OSError):
+                stale = True
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+    return removed
+
+class RunWorkspace:
+    """with RunWorkspace() as ws: path = ws.path_for("audio.m4a")"""
+    def __init__(self, quota_bytes=DEFAULT_QUOTA_BYTES, root=None):
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        self._reserved = 0
+        self.path = tempfile.mkdtemp(prefix=f"{WORKSPACE_PREFIX}{os.getpid()}_", dir=root or workspace_root(quota_bytes))
+
+    def path_for(self, name):
+        return os.path.join(self.path, name)
+
+    def usage(self):
+        total = 0
+        for dirpath, _, files in os.walk(self.path):
+            for f in files:
+                try: total += os.path.getsize(os.path.join(dirpath, f))
+                except OSError: pass
+        return total
+
+    def remaining(self):
+        """扣掉已落地的檔案與進行中下載的預留量"""
+        return max(0, self.quota_bytes - self.usage() - self._reserved)
+
+    @contextmanager
+    def reserve(self, max_bytes=None):
+        """with ws.reserve(AUDIO_RESERVE_BYTES) as limit: 下載 (max_filesize=limit)
+        在鎖內預留空間，並行的下載加總不會超過配額；已無空間時直接拒絕。檔案落地後離開 with 即釋放，之後由 usage() 計入"""
+        with self._lock:
+            available = self.remaining()
+            if available <= 0:
+                raise WorkspaceQuotaExceeded(f"暫存空間已用完 (上限 {self.quota_bytes // 1024 ** 2} MB)，略過下載")
+            amount = min(available, max_bytes) if max_bytes else available
+            self._reserved += amount
+        try: yield amount
+        finally:
+            with self._lock: self._reserved -= amount
+
+    def check_quota(self):
+        used = self.usage()
+        if used > self.quota_bytes:
+            raise WorkspaceQuotaExceeded(f"暫存空間超過上限 ({used // 1024 ** 2} MB > {self.quota_bytes // 1024 ** 2} MB)")
+
+    def close(self):
+        # 背景刪除，不阻塞 UI；若行程在刪完前結束，下次啟動時由 sweep_orphans 收尾
+        threading.Thread(target=shutil.rmtree, args=(self.path, True), daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False